@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Effect of the sqlite pragmas on inserts and reports.
+
+Run from the repository root: python -m benchmarks.pragmas
+"""
+
+from expenses.data_connector import db_create, db_connect, drop_engine,\
+    db_upgrade, recommended_pragmas
+from expenses.data_model import Expense
+from expenses.currencies import statistics
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import path
+import argparse
+import datetime as dt
+import random
+import time
+
+
+profiles = [('default', {}),
+            ('recommended', recommended_pragmas),
+            ('no sync', {'journal_mode': 'WAL', 'synchronous': 'OFF'})]
+
+
+def run(pragmas, expenses, reports):
+    directory = mkdtemp()
+    name = path.join(directory, 'benchmark.db')
+    try:
+        db_create(name)
+        db = db_connect(name, pragmas=pragmas)
+        db_upgrade(db)
+        rng = random.Random(0)
+
+        # one commit per expense, like App.track_expense
+        started = time.perf_counter()
+        for _ in range(expenses):
+            price = rng.randint(100, 10000)
+            db.add(Expense(issued=dt.datetime(2020, rng.randint(1, 12),
+                                              rng.randint(1, 28)),
+                           price=price, in_eur=price, currency_id=1,
+                           category_id=1))
+            db.commit()
+        inserts = expenses / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for i in range(reports):
+            statistics(db, 2020, i % 12 + 1)
+        report_rate = reports / (time.perf_counter() - started)
+
+        db.close()
+        drop_engine(name, None)
+        return inserts, report_rate
+    finally:
+        rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--expenses', type=int, default=2000)
+    parser.add_argument('--reports', type=int, default=120)
+    args = parser.parse_args()
+
+    print('{:>12} {:>14} {:>14}'.format('pragmas', 'inserts/s',
+                                        'reports/s'))
+    for label, pragmas in profiles:
+        inserts, reports = run(pragmas, args.expenses, args.reports)
+        print('{:>12} {:>14.0f} {:>14.1f}'.format(label, inserts, reports))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Time reports, backups and currency conversion on synthetic databases.
+
+Every size given with --rows gets its own database. Results are printed
+and written as JSON, to compare two runs keep their files.
+
+Run from the repository root: python -m benchmarks.run --rows 1000 100000
+"""
+
+from benchmarks.synthetic import create_database
+from expenses import currencies
+from expenses.currencies import statistics, to_eur, to_eur_many
+from expenses.reports import statistics_range
+from expenses.data_connector import write_backup, load_backup,\
+    remove_old_backups, drop_engine, backup_filename, delta_filename
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import mkdtemp
+from shutil import rmtree
+from threading import Thread
+from os import path, makedirs, listdir
+import argparse
+import datetime as dt
+import json
+import platform
+import sqlalchemy
+import statistics as stats
+import time
+
+
+def timed(function, repeat=1):
+    """Median seconds of repeat calls and the result of the last one."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - started)
+    return stats.median(times), result
+
+
+class RateHandler(BaseHTTPRequestHandler):
+    """Answers every request like the rate api, with fixed rates."""
+
+    # keep-alive, so the shared session reuses its connection
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = json.dumps({'base': 'EUR', 'rates': {
+            'USD': 1.15, 'CHF': 1.1, 'GBP': 0.87}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def rate_server():
+    """Start a local stub of the rate api, returns the server."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RateHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_statistics(db, results, rows):
+    year = dt.datetime.now().year - 1
+    seconds, _ = timed(lambda: [statistics(db, year, month)
+                                for month in range(1, 13)], repeat=3)
+    results.append({'name': 'statistics', 'rows': rows,
+                    'seconds': seconds / 12, 'unit': 'month'})
+    seconds, _ = timed(lambda: statistics_range(
+        db, dt.datetime(year, 1, 1), dt.datetime(year, 12, 1)), repeat=3)
+    results.append({'name': 'statistics_range', 'rows': rows,
+                    'seconds': seconds, 'unit': 'year'})
+
+
+def bench_backups(db, directory, results, rows):
+    for backup_format in ('json', 'compact'):
+        backup_directory = path.join(directory, 'backup_{}_{}'.format(
+            rows, backup_format))
+        seconds, filename = timed(lambda: write_backup(
+            db, backup_directory, backup_format=backup_format))
+        results.append({'name': 'write_backup', 'format': backup_format,
+                        'rows': rows, 'seconds': seconds,
+                        'bytes': path.getsize(filename)})
+        seconds, (restored, _) = timed(lambda: load_backup(
+            db, path.basename(filename), backup_directory))
+        results.append({'name': 'load_backup', 'format': backup_format,
+                        'rows': restored, 'seconds': seconds})
+
+
+def bench_retention(directory, results, files):
+    """remove_old_backups over a directory with a backup every 6 hours."""
+    backup_directory = path.join(directory, 'retention')
+    makedirs(backup_directory)
+    now = dt.datetime.now()
+    for i in range(files):
+        time_of_backup = now - dt.timedelta(hours=6 * i)
+        name_format = delta_filename if i % 4 else backup_filename
+        with open(path.join(backup_directory,
+                            time_of_backup.strftime(name_format)), 'w') as f:
+            if i % 4:
+                # chained to the full backup written before
+                base = time_of_backup + dt.timedelta(hours=6 * (i % 4))
+                f.write('Base\n' + json.dumps(
+                    {'base': base.strftime(backup_filename)}) + '\n')
+    # the first run has to build the manifest from the files
+    seconds, _ = timed(lambda: remove_old_backups(backup_directory))
+    results.append({'name': 'remove_old_backups', 'files': files,
+                    'kept': len(listdir(backup_directory)) - 1,
+                    'seconds': seconds, 'manifest': False})
+    seconds, _ = timed(lambda: remove_old_backups(backup_directory), 3)
+    results.append({'name': 'remove_old_backups',
+                    'files': len(listdir(backup_directory)) - 1,
+                    'seconds': seconds, 'manifest': True})
+
+
+def bench_to_eur(results, conversions):
+    server = rate_server()
+    currencies.rate_api = 'http://127.0.0.1:{}/{{date}}?symbols={{symb}}'\
+        .format(server.server_port)
+    days = [dt.date(2020, 1, 1) + dt.timedelta(days=i)
+            for i in range(conversions)]
+    try:
+        currencies.clear_rate_cache()
+        seconds, _ = timed(lambda: [to_eur(1000, 'USD', day)
+                                    for day in days])
+        results.append({'name': 'to_eur', 'cache': 'cold',
+                        'conversions': conversions, 'seconds': seconds})
+        seconds, _ = timed(lambda: [to_eur(1000, 'USD', day)
+                                    for day in days], repeat=3)
+        results.append({'name': 'to_eur', 'cache': 'warm',
+                        'conversions': conversions, 'seconds': seconds})
+        currencies.clear_rate_cache()
+        seconds, _ = timed(lambda: to_eur_many(
+            (1000, identifier, day) for day in days
+            for identifier in ('USD', 'CHF', 'GBP')))
+        results.append({'name': 'to_eur_many', 'cache': 'cold',
+                        'conversions': 3 * conversions,
+                        'seconds': seconds})
+    finally:
+        server.shutdown()
+        server.server_close()
+        currencies.clear_rate_cache()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--backup-files', type=int, default=2000)
+    parser.add_argument('--conversions', type=int, default=200)
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args()
+
+    results = []
+    directory = mkdtemp()
+    try:
+        for rows in args.rows:
+            name = path.join(directory, 'benchmark_{}.db'.format(rows))
+            seconds, db = timed(lambda: create_database(name, rows,
+                                                        args.years))
+            results.append({'name': 'create_database', 'rows': rows,
+                            'seconds': seconds})
+            bench_statistics(db, results, rows)
+            bench_backups(db, directory, results, rows)
+            db.close()
+            drop_engine(name, None)
+        bench_retention(directory, results, args.backup_files)
+        bench_to_eur(results, args.conversions)
+    finally:
+        rmtree(directory)
+
+    for result in results:
+        details = ', '.join('{}={}'.format(key, value)
+                            for key, value in result.items()
+                            if key not in ('name', 'seconds'))
+        print('{:>20} {:>10.4f}s  {}'.format(result['name'],
+                                             result['seconds'], details))
+
+    with open(args.output, 'w') as f:
+        json.dump({'time': dt.datetime.now().isoformat(),
+                   'python': platform.python_version(),
+                   'sqlalchemy': sqlalchemy.__version__,
+                   'platform': platform.platform(),
+                   'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Import time of the command line commands.
+
+Every command runs its imports in a fresh interpreter with -X importtime,
+the table shows the total and the packages that took longest, with the
+time of all their modules.
+
+Run from the repository root: python -m benchmarks.startup
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+# what each command of cli.py imports before it touches the database
+commands = [
+    ('cli', 'import cli'),
+    ('stats', 'import cli; '
+     'import command_line.output, command_line.session'),
+    ('history', 'import cli; '
+     'import command_line.output, command_line.session'),
+    ('track', 'import cli; import command_line.session, '
+     'expenses.reference_data'),
+    ('backup', 'import cli; import command_line.session'),
+    ('interactive', 'import cli; import command_line.interactive'),
+]
+
+
+def import_times(code):
+    """Microseconds spent importing each package."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        times[package] = times.get(package, 0) + int(own)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=4)
+    args = parser.parse_args()
+
+    print('{:>12} {:>10}  {}'.format('command', 'ms', 'slowest imports'))
+    for label, code in commands:
+        runs = [import_times(code) for _ in range(args.runs)]
+        total = statistics.median(sum(x.values()) for x in runs) / 1000.0
+        slowest = sorted(runs[-1].items(), key=lambda x: -x[1])[:args.top]
+        print('{:>12} {:>10.1f}  {}'.format(label, total, ', '.join(
+            '{} {:.0f}'.format(name, us / 1000.0) for name, us in slowest)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Databases filled with random but plausible expenses.
+
+Run from the repository root to keep one around:
+python -m benchmarks.synthetic expenses.db --rows 100000
+"""
+
+from expenses.data_connector import db_create, db_connect, db_upgrade,\
+    insert_rows
+from expenses.data_model import Expense, Category
+from expenses.aggregates import rebuild_aggregates
+from expenses.reference_data import currencies, invalidate_reference_data
+import argparse
+import datetime as dt
+import random
+
+
+categories = ['Lebensmittel', 'Miete', 'Transport', 'Freizeit', 'Kleidung',
+              'Reisen', 'Versicherung', 'Gesundheit', 'Geschenke']
+# (identifier, share of the expenses, rough rate)
+currency_mix = [('EUR', 0.85, 1.0), ('USD', 0.08, 1.15),
+                ('CHF', 0.04, 1.1), ('GBP', 0.03, 0.87)]
+# share of long term and of repeating expenses, the rest is plain
+default_mix = (0.12, 0.08)
+
+
+def random_expenses(rng, rows, start, days, category_ids, currency_ids,
+                    mix=default_mix):
+    """Yield rows dicts for the expenses table.
+
+    Plain expenses are spread over the days, more of them recently, with
+    a few big ones. Long term expenses last days up to two years,
+    repeating ones repeat every one to twelve months, half of them end.
+    """
+    long_term, repeating = mix
+    identifiers = [x[0] for x in currency_mix]
+    weights = [x[1] for x in currency_mix]
+    rates = {x[0]: x[2] for x in currency_mix}
+    for _ in range(rows):
+        # triangular, more expenses towards the end of the range
+        day = int(rng.triangular(0, days, days))
+        issued = start + dt.timedelta(days=day, minutes=rng.randint(
+            7 * 60, 23 * 60))
+        identifier = rng.choices(identifiers, weights)[0]
+        price = int(rng.lognormvariate(7, 1.2)) + 1
+        end = None
+        repeat_interval = None
+        kind = rng.random()
+        if kind < long_term:
+            end = issued + dt.timedelta(days=rng.randint(1, 730))
+        elif kind < long_term + repeating:
+            repeat_interval = rng.choice([1, 1, 1, 3, 6, 12])
+            if rng.random() < 0.5:
+                end = issued + dt.timedelta(days=rng.randint(30, 1500))
+        yield {'issued': issued,
+               'end': end,
+               'repeat_interval': repeat_interval,
+               'price': price,
+               'in_eur': int(round(price / rates[identifier])),
+               'note': None,
+               'currency_id': currency_ids[identifier],
+               'category_id': rng.choice(category_ids)}
+
+
+def create_database(name, rows, years=5, seed=0, mix=default_mix,
+                    password=None, chunk_size=10000):
+    """Create a database with rows random expenses over the last years.
+
+    Returns an open session.
+    """
+    db_create(name, password=password)
+    db = db_connect(name, password=password)
+    db_upgrade(db)
+    db.add_all([Category(name=x) for x in categories])
+    db.commit()
+    invalidate_reference_data(db)
+
+    category_ids = [x.id for x in db.query(Category)]
+    currency_ids = {x.identifier: x.id for x in currencies(db)}
+    end = dt.datetime(dt.datetime.now().year, 1, 1)
+    start = end.replace(year=end.year - years)
+    rng = random.Random(seed)
+
+    chunk = []
+    for row in random_expenses(rng, rows, start, (end - start).days,
+                               category_ids, currency_ids, mix):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            insert_rows(db, Expense, chunk)
+            chunk = []
+    insert_rows(db, Expense, chunk)
+    db.commit()
+    rebuild_aggregates(db)
+    return db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('name')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--password')
+    args = parser.parse_args()
+    db = create_database(args.name, args.rows, args.years, args.seed,
+                         password=args.password)
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
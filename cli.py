@@ -1,182 +1,274 @@
-from expenses.data_connector import db_connect, db_disconnect,\
-    load_config, write_backup, load_backup, remove_old_backups
-from command_line.user_input import type_input, list_choice,\
-    query_choice, bool_question, str_input, dt_input
-from expenses.data_model import Expense, Currency, Category
-from expenses.currencies import to_eur, statistics
-from sqlalchemy.exc import DatabaseError
+"""Track expenses, interactively or with one of the commands.
+
+Modules are imported by the command that needs them, so short commands
+like stats start fast.
+"""
+
+import argparse
 import datetime as dt
-from os.path import exists
-from os import listdir
+import sys
+
+
+def _date(text):
+    for date_format in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return dt.datetime.strptime(text, date_format)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(
+        "'{}' is not a date (YYYY-MM-DD or YYYY-MM-DD HH:MM)".format(text))
+
+
+def _config():
+    from expenses.data_connector import load_config
+    try:
+        return load_config()
+    except FileNotFoundError:
+        sys.exit('No config found, please try python manage.py')
+
+
+def _connect(config, rates=False):
+    from command_line.session import open_database, load_rate_history
+    if rates:
+        load_rate_history(config)
+    return open_database(config)
+
+
+def _reference(rows, name, kind):
+    """Currency or category row by identifier or name."""
+    for row in rows:
+        if name.lower() in (row.name.lower(),
+                            getattr(row, 'identifier', '').lower()):
+            return row
+    sys.exit('unknown {} {}'.format(kind, name))
+
+
+def interactive(args):
+    from command_line.interactive import App
+    app = App()
+    app.main_menu()
+
+
+def track(args):
+    from command_line.session import add_expense, close_database
+    from expenses.reference_data import currencies, categories
+    config = _config()
+    db, _, db_password = _connect(config, rates=True)
+    expense = add_expense(
+        db, int(round(args.price * 100)),
+        _reference(currencies(db), args.currency, 'currency'),
+        _reference(categories(db), args.category, 'category'),
+        args.date or dt.datetime.now(), note=args.note, end=args.end,
+        repeat=args.repeat)
+    if expense.in_eur is None:
+        print('No rate available, the conversion is pending')
+    else:
+        print('That was an expense of {:.2f}€'.format(
+            expense.in_eur / 100.0))
+    close_database(db, config, db_password)
+
+
+def resolve(args):
+    from command_line.session import close_database
+    from expenses.pending import resolve_pending
+    config = _config()
+    db, _, db_password = _connect(config, rates=True)
+    converted, pending = resolve_pending(db)
+    print('converted {} expenses, {} still pending'.format(converted,
+                                                          pending))
+    close_database(db, config, db_password)
+
+
+def stats(args):
+    from command_line.output import print_statistics
+    from expenses.data_connector import db_disconnect
+    config = _config()
+    db, _, _ = _connect(config)
+    print_statistics(db, config, args.year, args.month)
+    db_disconnect(db)
+
 
+def household(args):
+    from command_line.output import print_household
+    from command_line.user_input import str_input
+    from expenses.household import household_statistics
+    members = _config().get('household')
+    if not members:
+        sys.exit("No 'household' databases in the config")
+    for member in members:
+        if 'raw_key' not in member and 'password' not in member:
+            member['password'] = str_input('passwort {}'.format(
+                member.get('name', member['db'])))
+    results, (categories, pending) = household_statistics(
+        members, args.year, args.month, processes=args.processes)
+    print_household(results, categories, pending, args.year, args.month)
 
-class App():
 
-    def __init__(self):
+def history(args):
+    from command_line.output import print_history
+    from expenses.data_connector import db_disconnect
+    from expenses.reference_data import categories, currencies
+    config = _config()
+    db, _, _ = _connect(config)
+    category_id = None
+    if args.category is not None:
+        category_id = _reference(categories(db), args.category,
+                                 'category').id
+    currency_id = None
+    if args.currency is not None:
+        currency_id = _reference(currencies(db), args.currency,
+                                 'currency').id
+    print_history(db, args.year, args.month, category_id=category_id,
+                  currency_id=currency_id)
+    db_disconnect(db)
+
+
+def backup(args):
+    from command_line.session import backup as write_backup
+    from expenses.data_connector import db_disconnect, remove_old_backups
+    config = _config()
+    db, _, db_password = _connect(config)
+    write_backup(db, config, db_password, incremental=not args.full)
+    remove_old_backups(config['backup_dir'])
+    db_disconnect(db)
+
+
+def restore(args):
+    from expenses.data_connector import list_backups, db_disconnect
+    config = _config()
+    backups = dict(list_backups(config['backup_dir']))
+    if args.name is None:
+        for name, entry in sorted(backups.items()):
+            print('{} ({}, {:.1f} kB)'.format(name, entry['format'],
+                                               entry['size'] / 1024.0))
+        return
+    if args.name not in backups:
+        sys.exit('no backup {}'.format(args.name))
+
+    from command_line.session import restore_backup
+    db, db_name, db_password = _connect(config)
+    db, rows, seconds = restore_backup(db, config, db_name, db_password,
+                                       args.name, backups[args.name])
+    if rows is not None:
+        print('restored {} rows in {:.1f}s ({:.0f} rows/s)'.format(
+            rows, seconds, rows / max(seconds, 1e-6)))
+    db_disconnect(db)
+
+
+def import_statement(args):
+    from command_line.session import close_database
+    from expenses.importer import import_csv, StatementError
+    from expenses.pending import pending_count
+    config = _config()
+    db, _, db_password = _connect(config, rates=True)
+    try:
+        rows, seconds = import_csv(db, args.filename, config.get('import'))
+    except StatementError as e:
+        sys.exit('import failed: {}'.format(e))
+    print('imported {} expenses in {:.1f}s'.format(rows, seconds))
+    pending = pending_count(db)
+    if pending:
+        print('{} expenses are waiting for their conversion, see resolve'
+              .format(pending))
+    close_database(db, config, db_password)
+
+
+def parser():
+    now = dt.datetime.now()
+    main = argparse.ArgumentParser(description=__doc__)
+    main.add_argument('--profile', action='store_true',
+                      help='print where the time went')
+    main.add_argument('--profile-output', metavar='FILE',
+                      help='also write every single event to FILE.json or '
+                      'a cProfile trace to FILE.prof')
+    main.set_defaults(command=interactive)
+    commands = main.add_subparsers(title='commands')
+
+    command = commands.add_parser('track', help='add an expense')
+    command.add_argument('price', type=float)
+    command.add_argument('--currency', default='EUR',
+                         help='identifier or name')
+    command.add_argument('--category', default='Sonstiges')
+    command.add_argument('--date', type=_date, help='default now')
+    command.add_argument('--note')
+    command.add_argument('--end', type=_date,
+                         help='end of a long term expense')
+    command.add_argument('--repeat', type=int, metavar='MONTHS')
+    command.set_defaults(command=track)
+
+    command = commands.add_parser(
+        'resolve', help='convert expenses stored without a rate')
+    command.set_defaults(command=resolve)
+
+    command = commands.add_parser('stats',
+                                  help='totals per category of a month')
+    command.add_argument('--month', type=int, default=now.month)
+    command.add_argument('--year', type=int, default=now.year)
+    command.set_defaults(command=stats)
+
+    command = commands.add_parser(
+        'household', help='totals of the household databases of the config')
+    command.add_argument('--month', type=int, default=now.month)
+    command.add_argument('--year', type=int, default=now.year)
+    command.add_argument('--processes', action='store_true',
+                         help='one process per database instead of threads')
+    command.set_defaults(command=household)
+
+    command = commands.add_parser('history', help='expenses of a month')
+    command.add_argument('--month', type=int, default=now.month)
+    command.add_argument('--year', type=int, default=now.year)
+    command.add_argument('--category')
+    command.add_argument('--currency', help='identifier or name')
+    command.set_defaults(command=history)
+
+    command = commands.add_parser('backup', help='back up what changed')
+    command.add_argument('--full', action='store_true',
+                         help='write a full backup')
+    command.set_defaults(command=backup)
+
+    command = commands.add_parser(
+        'restore', help='replace all data with a backup, lists the backups '
+        'without a name')
+    command.add_argument('name', nargs='?')
+    command.set_defaults(command=restore)
+
+    command = commands.add_parser('import', help='import a bank statement')
+    command.add_argument('filename')
+    command.set_defaults(command=import_statement)
+    return main
+
+
+def run(args):
+    """Run the command, profiled if asked for or set in the config."""
+    target = args.profile_output or args.profile
+    if not target:
+        # true or a file name like --profile-output
+        from expenses.data_connector import load_config
         try:
-            self.config = load_config()
+            target = load_config().get('profile')
         except FileNotFoundError:
-            print('No config found, please try python manage.py')
-            backup_dir = str_input('backup directory', default='backup')
-            self.config = {'backup_dir': backup_dir}
-
-        if 'db' not in self.config:
-            file_valid = False
-            while not file_valid:  # test if file exists
-                db_name = str_input('datenbank', default='test') + '.db'
-                file_valid = exists(db_name)
-                if not file_valid:
-                    print('File not found :(')
-        else:
-            db_name = self.config['db']
-
-        success = False
-        if 'password' in self.config:
-            database = db_connect(db_name, password=self.config['password'])
-            try:
-                database.query(Currency).all()
-                success = True
-            except DatabaseError:
-                success = False
-                # now user can still input
-
-        while not success:
-            db_password = str_input('passwort', default='123456')
-            database = db_connect(db_name, password=db_password)
-            # try if password was correct
-            try:
-                database.query(Currency).all()
-                success = True
-            except DatabaseError:
-                success = False
-
-        # FINALLY
-        self.db = database
-
-    def end(self):
-        if 'backup_dir' not in self.config:
-            backup_dir = str_input('specify backup directory')
-            self.config['backup_dir'] = backup_dir
-
-        write_backup(self.db, self.config['backup_dir'])
-        remove_old_backups(self.config['backup_dir'])
-        db_disconnect(self.db)
-
-    def main_menu(self):
-        menu = ''
-        while menu != 'exit':
-            menu = list_choice(['track expense', 'last month',
-                                'categories', 'load backup', 'exit'])
-            if menu == 'exit':
-                self.end()
-            elif menu == 'track expense':
-                self.track_expense()
-            elif menu == 'last month':
-                self.history()
-                self.stats()
-            elif menu == 'categories':
-                self.edit_categories()
-            elif menu == 'load backup':
-                self.select_backup()
-
-    def track_expense(self):
-        price = type_input('price', float)
-        price = int(price * 100)
-
-        currency = query_choice(self.db.query(Currency))
-
-        cat = query_choice(self.db.query(Category))
-
-        advanced = bool_question('advanced options?', default=False)
-        # initialize with simple setup
-        issued = dt.datetime.now()
-        note = None
-        end = None
-        repeat = None
-        if advanced:
-            if bool_question('Not issued right now?', default=False):
-                issued = dt_input('Date if issue')
-
-            if bool_question('Do you want to add a note?', default=False):
-                note = str_input('Note')
-
-            if bool_question('long term expense?', default=False):
-                end = dt_input('End if expense')
-
-            if bool_question('repeat?', default=False):
-                repeat = type_input('Repeat this expense every _ months', int,
-                                    default=-1)
-                if repeat == -1:
-                    repeat = None
-
-        eur = to_eur(price, currency.identifier, issued)
-        print('That was an expense of {:.2f}€'.format(eur / 100.0))
-
-        expense = Expense(issued=issued,
-                          price=price,
-                          in_eur=eur,
-                          note=note,
-                          end=end,
-                          repeat_interval=repeat,
-                          currency=currency,
-                          category=cat)
-        self.db.add(expense)
-        self.db.commit()
-
-        if bool_question('another expense?', default=True):
-            self.track_expense()
-
-    def history(self):
-        for item in self.db.query(Expense):
-            print(item)
-
-    def stats(self):
-        now = dt.datetime.now()
-        month = type_input('month', int, default=now.month)
-        (categories, repeaters) = statistics(self.db, now.year, month)
-
-        print('\nStatistics for {}'.format(
-            dt.datetime(now.year, month, 1).strftime('%B')))
-
-        total = 0
-        for key, amount in categories.items():
-            total += amount
-            amount_str = '{:.2f}'.format(amount / 100.0)
-            print('{cat.name:>16}: {amount:>8} €'.format(
-                cat=self.db.query(Category).get(key), amount=amount_str))
-        print('{:>16}: {:>8} €'.format(
-            'TOTAL', '{:.2f}'.format(total / 100.0)))
-
-        print('\nwith these repeating expenses considered')
-        for item in repeaters:
-            print(item)
-
-    def edit_categories(self):
-        for item in self.db.query(Category):
-            print(item.name)
-        menu = list_choice(['add', 'edit', 'delete', 'back'])
-        if menu == 'add':
-            new = Category(name=str_input('Name'))
-            self.db.add(new)
-        elif menu == 'edit':
-            edit = query_choice(self.db.query(Category))
-            edit.name = str_input('New name')
-        elif menu == 'delete':
-            rm = query_choice(self.db.query(Category))
-            self.db.delete(rm)
-        self.db.commit()
-
-    def select_backup(self):
-        filename = list_choice(listdir(self.config['backup_dir']))
-        if bool_question('are you sure you want to overwrite all data?',
-                         default=False):
-            # first of all, backup existing data
-            write_backup(self.db, self.config['backup_dir'])
-
-            # now load new data
-            load_backup(self.db, filename, self.config['backup_dir'])
+            pass
+    if not target:
+        args.command(args)
+        return
+
+    from expenses import instrumentation
+    instrumentation.enable()
+    profiler = None
+    if str(target).endswith('.prof'):
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        args.command(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(target)
+        instrumentation.print_summary()
+        if str(target).endswith('.json'):
+            instrumentation.write_trace(target)
 
 
 if __name__ == '__main__':
-    app = App()
-    app.main_menu()
+    run(parser().parse_args())
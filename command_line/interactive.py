@@ -0,0 +1,239 @@
+from expenses.data_connector import load_config, list_backups
+from command_line.user_input import type_input, list_choice,\
+    query_choice, bool_question, str_input, dt_input
+from command_line.session import open_database, load_rate_history, backup,\
+    close_database, add_expense, restore_backup
+from command_line.output import print_statistics, print_history
+from expenses.data_model import Category
+from expenses.currencies import explain_statistics
+from expenses.aggregates import category_removed, rebuild_aggregates,\
+    check_aggregates
+from expenses.importer import import_csv, StatementError
+from expenses.pending import BackgroundRates, resolve_pending,\
+    pending_count
+from expenses.reference_data import currencies, categories,\
+    category_names, invalidate_reference_data
+import datetime as dt
+from os.path import exists
+
+
+class App():
+
+    def __init__(self, config=None):
+        if config is None:
+            try:
+                config = load_config()
+            except FileNotFoundError:
+                print('No config found, please try python manage.py')
+                backup_dir = str_input('backup directory', default='backup')
+                config = {'backup_dir': backup_dir}
+        self.config = config
+
+        load_rate_history(self.config)
+
+        # FINALLY
+        (self.db, self.db_name, self.db_password) = \
+            open_database(self.config)
+        self.rates = BackgroundRates()
+
+    def end(self):
+        if 'backup_dir' not in self.config:
+            backup_dir = str_input('specify backup directory')
+            self.config['backup_dir'] = backup_dir
+
+        self.rates.close(self.db)
+        _, pending = resolve_pending(self.db)
+        if pending:
+            print('{} expenses are still waiting for their conversion'
+                  .format(pending))
+        close_database(self.db, self.config, self.db_password)
+
+    def write_backup(self, incremental=False):
+        backup(self.db, self.config, self.db_password,
+               incremental=incremental)
+
+    def main_menu(self):
+        menu = ''
+        while menu != 'exit':
+            menu = list_choice(['track expense', 'import statement',
+                                'last month', 'year overview', 'categories',
+                                'load backup', 'maintenance', 'exit'])
+            if menu == 'exit':
+                self.end()
+            elif menu == 'track expense':
+                self.track_expense()
+            elif menu == 'import statement':
+                self.import_statement()
+            elif menu == 'last month':
+                now = dt.datetime.now()
+                month = type_input('month', int, default=now.month)
+                category_id, currency_id = self.history_filters()
+                self.history(now.year, month, category_id=category_id,
+                             currency_id=currency_id)
+                self.stats(now.year, month)
+            elif menu == 'year overview':
+                self.year_overview()
+            elif menu == 'categories':
+                self.edit_categories()
+            elif menu == 'load backup':
+                self.select_backup()
+            elif menu == 'maintenance':
+                self.maintenance()
+
+    def track_expense(self):
+        # convert what the background fetches made possible
+        self.rates.collect(self.db)
+        resolve_pending(self.db, fetch=False)
+
+        price = type_input('price', float)
+        price = int(price * 100)
+
+        currency = query_choice(currencies(self.db))
+        # the rate is fetched while the user goes on
+        self.rates.request(currency.identifier, dt.datetime.now(), self.db)
+
+        cat = query_choice(categories(self.db))
+
+        advanced = bool_question('advanced options?', default=False)
+        # initialize with simple setup
+        issued = dt.datetime.now()
+        note = None
+        end = None
+        repeat = None
+        if advanced:
+            if bool_question('Not issued right now?', default=False):
+                issued = dt_input('Date if issue')
+
+            if bool_question('Do you want to add a note?', default=False):
+                note = str_input('Note')
+
+            if bool_question('long term expense?', default=False):
+                end = dt_input('End if expense')
+
+            if bool_question('repeat?', default=False):
+                repeat = type_input('Repeat this expense every _ months', int,
+                                    default=-1)
+                if repeat == -1:
+                    repeat = None
+
+        self.rates.collect(self.db)
+        expense = add_expense(self.db, price, currency, cat, issued,
+                              note=note, end=end, repeat=repeat, defer=True)
+        if expense.in_eur is None:
+            self.rates.request(currency.identifier, issued, self.db)
+            print('Saved, the conversion to € follows')
+        else:
+            print('That was an expense of {:.2f}€'.format(
+                expense.in_eur / 100.0))
+
+        if bool_question('another expense?', default=True):
+            self.track_expense()
+
+    def import_statement(self):
+        filename = str_input('csv file')
+        if not exists(filename):
+            print('File not found :(')
+            return
+        try:
+            rows, seconds = import_csv(self.db, filename,
+                                       self.config.get('import'))
+        except StatementError as e:
+            print('import failed: {}'.format(e))
+            return
+        print('imported {} expenses in {:.1f}s'.format(rows, seconds))
+        pending = pending_count(self.db)
+        if pending:
+            print('{} expenses are waiting for their conversion'
+                  .format(pending))
+
+    def history_filters(self):
+        """Category and currency id to filter the history by, or None."""
+        category_id = None
+        currency_id = None
+        if bool_question('only one category?', default=False):
+            category_id = query_choice(categories(self.db)).id
+        if bool_question('only one currency?', default=False):
+            currency_id = query_choice(currencies(self.db)).id
+        return category_id, currency_id
+
+    def history(self, year, month, category_id=None, currency_id=None):
+        print_history(self.db, year, month, category_id=category_id,
+                      currency_id=currency_id)
+
+    def stats(self, year, month):
+        print_statistics(self.db, self.config, year, month)
+
+    def year_overview(self):
+        from expenses.reports import statistics_range
+
+        year = type_input('year', int, default=dt.datetime.now().year)
+        report = statistics_range(self.db, dt.datetime(year, 1, 1),
+                                  dt.datetime(year, 12, 1))
+
+        print('\nStatistics for {} in €'.format(year))
+        print('{:>16}  '.format('') + ''.join(
+            '{:>8}'.format(dt.datetime(year, month, 1).strftime('%b'))
+            for _, month in report.months))
+        names = category_names(self.db)
+        rows = list(zip(report.category_ids, report.amounts.T))
+        rows.append(('TOTAL', report.amounts.sum(axis=1)))
+        for key, amounts in rows:
+            print('{:>16}: '.format(names.get(key, key)) + ''.join(
+                '{:>8.0f}'.format(amount / 100.0) for amount in amounts))
+
+    def edit_categories(self):
+        for item in categories(self.db):
+            print(item.name)
+        menu = list_choice(['add', 'edit', 'delete', 'back'])
+        if menu == 'add':
+            new = Category(name=str_input('Name'))
+            self.db.add(new)
+        elif menu == 'edit':
+            edit = query_choice(categories(self.db))
+            edit = self.db.query(Category).get(edit.id)
+            edit.name = str_input('New name')
+        elif menu == 'delete':
+            rm = query_choice(categories(self.db))
+            rm = self.db.query(Category).get(rm.id)
+            category_removed(self.db, rm)
+            self.db.delete(rm)
+        self.db.commit()
+        invalidate_reference_data(self.db)
+
+    def maintenance(self):
+        menu = list_choice(['rebuild statistics', 'check statistics',
+                            'query plans', 'back'])
+        if menu == 'rebuild statistics':
+            rebuild_aggregates(self.db)
+        elif menu == 'check statistics':
+            differences = check_aggregates(self.db)
+            for year, month, category_id, stored, live in differences:
+                print('{}-{:02d} category {}: stored {:.2f}, live {:.2f}'
+                      .format(year, month, category_id, stored / 100.0,
+                              live / 100.0))
+            print('{} differences found'.format(len(differences)))
+        elif menu == 'query plans':
+            now = dt.datetime.now()
+            for name, plan in explain_statistics(self.db, now.year,
+                                                 now.month):
+                print('\n{}:'.format(name))
+                for step in plan:
+                    print('  ' + step)
+
+    def select_backup(self):
+        backups = list_backups(self.config['backup_dir'])
+        labels = []
+        for name, entry in backups:
+            rows = '?' if entry['rows'] is None else \
+                sum(entry['rows'].values())
+            labels.append('{} ({}, {:.1f} kB, {} rows)'.format(
+                name, entry['format'], entry['size'] / 1024.0, rows))
+        (filename, entry) = backups[labels.index(list_choice(labels))]
+        if bool_question('are you sure you want to overwrite all data?',
+                         default=False):
+            self.db, rows, seconds = restore_backup(
+                self.db, self.config, self.db_name, self.db_password,
+                filename, entry)
+            if rows is not None:
+                print('restored {} rows in {:.1f}s ({:.0f} rows/s)'.format(
+                    rows, seconds, rows / max(seconds, 1e-6)))
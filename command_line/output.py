@@ -0,0 +1,85 @@
+from expenses.reference_data import category_names, describe_expense
+from expenses.history import expense_history
+from expenses.currencies import pending_amounts
+import datetime as dt
+
+
+def month_statistics(db, config, year, month):
+    """Categories and repeaters of a month from the configured backend.
+
+    The backends are imported when used, the numpy based ones are slow to
+    load, so the default is statistics().
+    """
+    backend = config.get('stats_backend', 'statistics')
+    if backend == 'aggregates':
+        from expenses.aggregates import aggregated_statistics
+        return aggregated_statistics(db, year, month)
+    if backend == 'columnar':
+        from expenses.columnar import columnar_statistics
+        return columnar_statistics(db, year, month)
+    if backend == 'range':
+        from expenses.reports import statistics_range
+        date = dt.datetime(year, month, 1)
+        report = statistics_range(db, date, date)
+        return dict(zip(report.category_ids,
+                        report.amounts[0].tolist())), report.repeaters[0]
+    from expenses.currencies import statistics
+    return statistics(db, year, month)
+
+
+def print_statistics(db, config, year, month):
+    date = dt.datetime(year, month, 1)
+    (amounts, repeaters) = month_statistics(db, config, year, month)
+    names = category_names(db)
+
+    print('\nStatistics for {}'.format(date.strftime('%B')))
+
+    total = 0
+    for key, amount in amounts.items():
+        total += amount
+        amount_str = '{:.2f}'.format(amount / 100.0)
+        print('{name:>16}: {amount:>8} €'.format(
+            name=names[key], amount=amount_str))
+    print('{:>16}: {:>8} €'.format(
+        'TOTAL', '{:.2f}'.format(total / 100.0)))
+    pending = pending_amounts(db, year, month)
+    if pending:
+        print('{:>16}: {}'.format('not converted', ', '.join(
+            '{:.2f} {}'.format(amount / 100.0, identifier)
+            for identifier, amount in sorted(pending.items()))))
+
+    print('\nwith these repeating expenses considered')
+    for item in repeaters:
+        print(describe_expense(db, item))
+
+
+def print_household(results, categories, pending, year, month):
+    """Table of the amounts per category, one column per member."""
+    date = dt.datetime(year, month, 1)
+    print('\nStatistics for {} in €'.format(date.strftime('%B %Y')))
+    names = [x['name'] for x in results]
+    print('{:>16}  '.format('') + ''.join(
+        '{:>10}'.format(name[:10]) for name in names + ['TOTAL']))
+    rows = [(category, [x['categories'].get(category, 0) for x in results]
+             + [amount])
+            for category, amount in sorted(categories.items())]
+    rows.append(('TOTAL', [sum(x['categories'].values()) for x in results]
+                 + [sum(categories.values())]))
+    for label, amounts in rows:
+        print('{:>16}: '.format(label) + ''.join(
+            '{:>10.2f}'.format(amount / 100.0) for amount in amounts))
+    if pending:
+        print('{:>16}: {}'.format('not converted', ', '.join(
+            '{:.2f} {}'.format(amount / 100.0, identifier)
+            for identifier, amount in sorted(pending.items()))))
+    for result in results:
+        if result['error'] is not None:
+            print('{} could not be read: {}'.format(result['name'],
+                                                    result['error']))
+
+
+def print_history(db, year, month, category_id=None, currency_id=None):
+    for page in expense_history(db, year, month, category_id=category_id,
+                                currency_id=currency_id):
+        for item in page:
+            print(item)
@@ -0,0 +1,156 @@
+from expenses.data_connector import db_connect, db_disconnect, drop_engine,\
+    db_upgrade, write_backup, remove_old_backups, write_incremental_backup,\
+    write_snapshot, check_password, load_backup, restore_snapshot
+from expenses.data_model import Expense, Currency
+from expenses.currencies import to_eur, known_rate, use_rate_history
+from expenses.rate_history import load_ecb_csv
+from expenses.aggregates import expense_added, rebuild_aggregates
+from expenses.pending import defer_conversion
+from command_line.user_input import str_input
+from sqlalchemy.exc import DatabaseError
+from os.path import exists
+
+
+def load_rate_history(config):
+    """Use the offline rate history of the config, if there is one."""
+    if 'rate_history' in config:
+        use_rate_history(load_ecb_csv(config['rate_history']))
+
+
+def _try_connect(db_name, db_password, config):
+    database = db_connect(db_name, password=db_password,
+                          pragmas=config.get('pragmas'),
+                          cipher=config.get('cipher'))
+    # try if password was correct
+    try:
+        database.query(Currency).all()
+        return database
+    except DatabaseError:
+        drop_engine(db_name, db_password)
+        return None
+
+
+def open_database(config):
+    """Connect to the database of the config, asks for what is missing.
+
+    Returns the session, the database file and the password or raw key.
+    """
+    if 'db' not in config:
+        file_valid = False
+        while not file_valid:  # test if file exists
+            db_name = str_input('datenbank', default='test') + '.db'
+            file_valid = exists(db_name)
+            if not file_valid:
+                print('File not found :(')
+    else:
+        db_name = config['db']
+
+    cipher = config.get('cipher')
+    database = None
+    # a stored raw key skips the key derivation of sqlcipher
+    stored_key = config.get('raw_key', config.get('password'))
+    if stored_key is not None:
+        db_password = stored_key
+        database = _try_connect(db_name, db_password, config)
+        # if it failed, user can still input
+
+    while database is None:
+        db_password = str_input('passwort', default='123456')
+        if config.get('cipher_header_check', True):
+            # derive the key once and check it against the file header
+            raw_key = check_password(db_name, db_password, **(cipher or {}))
+            if raw_key is not None:
+                database = _try_connect(db_name, raw_key, config)
+        if database is not None:
+            db_password = raw_key
+        else:
+            # the check only knows SQLCipher 4 and the cipher settings of
+            # the config, sqlcipher also opens files made with others
+            database = _try_connect(db_name, db_password, config)
+            if database is None:
+                print('Wrong password')
+
+    if 'monthly_totals' in db_upgrade(database):
+        # database from before the stored totals
+        rebuild_aggregates(database)
+    return database, db_name, db_password
+
+
+def backup(db, config, db_password, incremental=False):
+    """Back up in the format of the config."""
+    backup_format = config.get('backup_format', 'json')
+    if backup_format == 'snapshot':
+        write_snapshot(db, config['backup_dir'], password=db_password,
+                       cipher=config.get('cipher'))
+    elif incremental:
+        write_incremental_backup(db, config['backup_dir'],
+                                 backup_format=backup_format)
+    else:
+        write_backup(db, config['backup_dir'], backup_format=backup_format)
+
+
+def close_database(db, config, db_password):
+    """Back up what changed, clean up old backups and disconnect."""
+    if 'backup_dir' in config:
+        backup(db, config, db_password, incremental=True)
+        remove_old_backups(config['backup_dir'])
+    db_disconnect(db)
+
+
+def add_expense(db, price, currency, category, issued, note=None, end=None,
+                repeat=None, defer=False):
+    """Convert, store and count a new expense, returns it.
+
+    currency and category are rows of expenses.reference_data. Without a
+    known rate the expense is stored pending, with defer right away,
+    otherwise if the rate api can not answer.
+    """
+    expense = Expense(issued=issued,
+                      price=price,
+                      note=note,
+                      end=end,
+                      repeat_interval=repeat,
+                      currency_id=currency.id,
+                      category_id=category.id)
+    if currency.identifier == 'EUR' or not defer or \
+            known_rate(currency.identifier, issued, db) is not None:
+        try:
+            expense.in_eur = to_eur(price, currency.identifier, issued,
+                                    db=db)
+        except (OSError, ValueError, KeyError):
+            # requests errors are OSErrors, the expense is kept anyway
+            pass
+    if expense.in_eur is None:
+        defer_conversion(db, expense)
+    else:
+        db.add(expense)
+        expense_added(db, expense)
+    db.commit()
+    return expense
+
+
+def restore_backup(db, config, db_name, db_password, filename, entry):
+    """Replace all data with a backup from the manifest.
+
+    The data is backed up first. Returns the session to go on with, it is
+    a new one after a snapshot swapped the database file, and the restored
+    rows and seconds, both None for snapshots.
+    """
+    # first of all, backup existing data
+    backup(db, config, db_password)
+
+    backup_dir = config['backup_dir']
+    if entry['format'] == 'snapshot':
+        # swap the database file, needs all connections closed
+        db_disconnect(db)
+        db.get_bind().dispose()
+        restore_snapshot(filename, backup_dir, db_name)
+        db = db_connect(db_name, password=db_password,
+                        pragmas=config.get('pragmas'),
+                        cipher=config.get('cipher'))
+        return db, None, None
+
+    # now load new data
+    rows, seconds = load_backup(db, filename, backup_dir)
+    rebuild_aggregates(db)
+    return db, rows, seconds
@@ -86,10 +86,12 @@ def list_choice(list):
 
 
 def query_choice(query):
+    # a query is only run once, lists of rows work the same
+    items = list(query)
     identifiers = {}
-    has_name = hasattr(query.first(), 'name')
+    has_name = bool(items) and hasattr(items[0], 'name')
     i = 1
-    for item in query:
+    for item in items:
         identifiers[i] = item
         if has_name:
             name = item.name
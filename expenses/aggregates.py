@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Stored monthly totals per category, kept up to date on every write.
+
+Repeating expenses have no end, so they are never stored and are added
+to the stored totals when a month is reported. Nothing deletes single
+expenses, rebuild_aggregates recomputes the totals after restores or
+changes made outside of the app.
+"""
+
+from expenses.data_model import Expense, MonthlyTotal
+from expenses.currencies import month_bounds, fractional_expense,\
+    repeating_expense, repeating_expenses
+from expenses.reference_data import category_ids
+
+
+def expense_shares(item):
+    """(month, amount) pairs a non repeating expense adds to statistics().
+
+    Months are counted as year * 12 + month.
+    """
+    if item.repeat_interval is not None or item.in_eur is None:
+        return []
+
+    first = item.issued.year * 12 + item.issued.month
+    last = first if item.end is None else item.end.year * 12 + item.end.month
+    shares = []
+    for index in range(first, last + 1):
+        year, month = divmod(index - 1, 12)
+        start_of_month, end_of_month = month_bounds(year, month + 1)
+        if item.end is None:
+            if start_of_month <= item.issued <= end_of_month:
+                shares.append((index, item.in_eur))
+        elif item.issued <= end_of_month and item.end >= start_of_month:
+            shares.append((index, fractional_expense(item, end_of_month,
+                                                     False)))
+    return shares
+
+
+def _add_shares(db, category_id, shares, sign):
+    for month, amount in shares:
+        if amount == 0:
+            continue
+        total = db.query(MonthlyTotal).get((month, category_id))
+        if total is None:
+            db.add(MonthlyTotal(month=month, category_id=category_id,
+                                amount=sign * amount))
+        else:
+            total.amount += sign * amount
+
+
+def expense_added(db, expense):
+    """Add a new expense to the stored totals."""
+    # sets category_id if the expense was built from a Category object
+    db.flush()
+    _add_shares(db, expense.category_id, expense_shares(expense), 1)
+
+
+def rows_added(db, rows):
+    """Add expenses inserted as row dicts to the stored totals."""
+    totals = {}
+    for row in rows:
+        for month, amount in expense_shares(Expense(**row)):
+            key = (row['category_id'], month)
+            totals[key] = totals.get(key, 0) + amount
+    for (category_id, month), amount in totals.items():
+        _add_shares(db, category_id, [(month, amount)], 1)
+
+
+def category_removed(db, category):
+    """Drop the totals of a category that is about to be deleted."""
+    db.query(MonthlyTotal).filter(
+        MonthlyTotal.category_id == category.id).delete()
+
+
+def rebuild_aggregates(db):
+    """Recompute all stored totals from the expenses."""
+    db.query(MonthlyTotal).delete()
+    totals = {}
+    for item in db.query(Expense).filter(
+            Expense.repeat_interval.is_(None)).yield_per(1000):
+        for month, amount in expense_shares(item):
+            key = (month, item.category_id)
+            totals[key] = totals.get(key, 0) + amount
+    db.bulk_insert_mappings(MonthlyTotal, [
+        {'month': month, 'category_id': category_id, 'amount': amount}
+        for (month, category_id), amount in totals.items() if amount != 0])
+    db.commit()
+
+
+def aggregated_statistics(db, year, month):
+    """Same as statistics(), read from the stored totals."""
+    categories = {x: 0 for x in category_ids(db)}
+    for total in db.query(MonthlyTotal).filter(
+            MonthlyTotal.month == year * 12 + month):
+        if total.category_id in categories:
+            categories[total.category_id] += total.amount
+
+    _, end_of_month = month_bounds(year, month)
+    repeaters = []
+    for item in repeating_expenses(db):
+        amount = repeating_expense(item, end_of_month)
+        categories[item.category_id] += amount
+        if amount > 0:
+            repeaters.append(item)
+
+    return categories, repeaters
+
+
+def check_aggregates(db):
+    """Compare the stored totals with a live computation.
+
+    Returns (year, month, category_id, stored, live) for every difference.
+    """
+    # needs numpy, which the other functions here do not
+    from expenses.reports import statistics_range
+    stored = {(x.month, x.category_id): x.amount
+              for x in db.query(MonthlyTotal)}
+    differences = []
+
+    first = db.query(Expense.issued).order_by(Expense.issued).first()
+    if first is not None:
+        latest = db.query(Expense.issued)\
+            .order_by(Expense.issued.desc()).first()
+        last_end = db.query(Expense.end).filter(Expense.end.isnot(None))\
+            .order_by(Expense.end.desc()).first()
+        end = latest[0] if last_end is None else max(latest[0], last_end[0])
+
+        report = statistics_range(db, first[0], end)
+        for i, (year, month) in enumerate(report.months):
+            _, end_of_month = month_bounds(year, month)
+            live = dict(zip(report.category_ids, report.amounts[i].tolist()))
+            for item in report.repeaters[i]:
+                live[item.category_id] -= repeating_expense(item,
+                                                            end_of_month)
+            for category_id, amount in live.items():
+                stored_amount = stored.pop((year * 12 + month, category_id),
+                                           0)
+                if stored_amount != amount:
+                    differences.append((year, month, category_id,
+                                        stored_amount, amount))
+
+    # totals in months without any expense
+    for (month, category_id), amount in stored.items():
+        if amount != 0:
+            differences.append(((month - 1) // 12, (month - 1) % 12 + 1,
+                                category_id, amount, 0))
+    return differences
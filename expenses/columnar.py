@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Statistics evaluated over column arrays of the whole expenses table."""
+
+from expenses.data_model import Expense
+from expenses.reference_data import category_ids
+from expenses.currencies import month_bounds
+import numpy as np
+
+
+def _time_of_day(value):
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * 1000000 \
+        + value.microsecond
+
+
+def _occurrences(step, offset, low, high):
+    """Count k >= 0 with low <= offset - k * step <= high, per row."""
+    first = np.maximum(0, -((high - offset) // step))
+    last = (offset - low) // step
+    return np.where(high < low, 0, np.maximum(0, last - first + 1))
+
+
+class ColumnarStatistics():
+    """Expenses as column arrays, statistics() for all rows at once.
+
+    Dates are kept as day ordinals plus the microseconds into the day, so
+    the comparisons with the month bounds and the day counts give exactly
+    what the datetime based functions in expenses.currencies give.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.category_ids = np.array(category_ids(db), dtype=np.int64)
+
+        columns = {'id': [], 'issued_day': [], 'issued_time': [],
+                   'issued_month': [], 'issued_dom': [], 'has_end': [],
+                   'end_day': [], 'end_time': [], 'end_month': [],
+                   'end_dom': [], 'repeat_interval': [], 'in_eur': [],
+                   'category_id': []}
+        query = db.query(Expense.id, Expense.issued, Expense.end,
+                         Expense.repeat_interval, Expense.in_eur,
+                         Expense.category_id)\
+            .filter(Expense.in_eur.isnot(None)).order_by(Expense.id)
+        for row in query.yield_per(10000):
+            # expenses without end behave as ending when they are issued
+            end = row.issued if row.end is None else row.end
+            columns['id'].append(row.id)
+            columns['issued_day'].append(row.issued.toordinal())
+            columns['issued_time'].append(_time_of_day(row.issued))
+            columns['issued_month'].append(row.issued.year * 12 +
+                                           row.issued.month)
+            columns['issued_dom'].append(row.issued.day)
+            columns['has_end'].append(row.end is not None)
+            columns['end_day'].append(end.toordinal())
+            columns['end_time'].append(_time_of_day(end))
+            columns['end_month'].append(end.year * 12 + end.month)
+            columns['end_dom'].append(end.day)
+            columns['repeat_interval'].append(row.repeat_interval or 0)
+            columns['in_eur'].append(row.in_eur)
+            columns['category_id'].append(row.category_id)
+
+        for name, values in columns.items():
+            dtype = np.bool_ if name == 'has_end' else np.int64
+            setattr(self, name, np.array(values, dtype=dtype))
+
+        self.is_repeating = self.repeat_interval != 0
+        self.is_simple = ~self.has_end & ~self.is_repeating
+        self.is_long_term = self.has_end & ~self.is_repeating
+        # (end - issued).days + 1 of the datetimes
+        self.total_days = self.end_day - self.issued_day + 1 - \
+            (self.end_time < self.issued_time)
+
+        # rows of deleted categories are left out, like in the stored totals
+        position = np.searchsorted(self.category_ids, self.category_id)
+        self.known_category = position < len(self.category_ids)
+        self.known_category[self.known_category] = \
+            self.category_ids[position[self.known_category]] == \
+            self.category_id[self.known_category]
+        self.category_position = position
+
+    def __len__(self):
+        return len(self.id)
+
+    def _share(self, in_month, mask):
+        """round(1.0 * in_month / total_days * in_eur) where mask is set."""
+        if np.any(mask & (self.total_days == 0)):
+            raise ZeroDivisionError('expense ends before it is issued')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = np.round(in_month.astype(np.float64) / self.total_days *
+                             self.in_eur)
+        return np.where(mask, share, 0).astype(np.int64)
+
+    def _amount_in_month(self, affected_month, month_length):
+        start = self.issued_month
+        end = self.end_month
+        in_month = np.where(
+            (start == affected_month) & (end == affected_month),
+            self.total_days, np.where(
+                (start < affected_month) & (end == affected_month),
+                np.minimum(month_length, self.end_dom), np.where(
+                    (start == affected_month) & (end > affected_month),
+                    np.maximum(month_length - self.issued_dom, 0),
+                    month_length)))
+        counts = (start <= affected_month) & (end >= affected_month)
+        return counts, in_month
+
+    def _repeating(self, affected_month, month_length, rows):
+        step = np.where(rows, self.repeat_interval, 1)
+        if np.any(step < 1):
+            raise ValueError('repeat interval has to be at least one month')
+        offset = affected_month - self.issued_month
+        duration = self.end_month - self.issued_month
+
+        def share(low, high, in_month):
+            count = np.where(rows, _occurrences(step, offset, low, high), 0)
+            return count * self._share(in_month, count > 0)
+
+        single = duration == 0
+        amount = np.where(single, share(0, 0, self.total_days), 0)
+        several = rows & (duration > 0)
+        amount += np.where(several, share(
+            0, 0, np.maximum(month_length - self.issued_dom, 0)), 0)
+        amount += np.where(several, share(1, duration - 1,
+                                          np.full_like(duration,
+                                                       month_length)), 0)
+        amount += np.where(several, share(
+            duration, duration, np.minimum(month_length, self.end_dom)), 0)
+        return np.where(rows, amount, 0)
+
+    def month_amounts(self, year, month):
+        """Amount every row counts into a month, in cents."""
+        start_of_month, end_of_month = month_bounds(year, month)
+        first_day = start_of_month.toordinal()
+        last_day = end_of_month.toordinal()
+        affected_month = year * 12 + month
+        month_length = end_of_month.day
+
+        # the month bounds are datetimes at midnight
+        issued_from_start = self.issued_day >= first_day
+        issued_until_end = (self.issued_day < last_day) | \
+            ((self.issued_day == last_day) & (self.issued_time == 0))
+        ends_from_start = self.end_day >= first_day
+
+        amounts = np.where(
+            self.is_simple & issued_from_start & issued_until_end,
+            self.in_eur, 0)
+
+        long_term = self.is_long_term & issued_until_end & ends_from_start
+        counts, in_month = self._amount_in_month(affected_month,
+                                                 month_length)
+        amounts += self._share(in_month, long_term & counts)
+
+        amounts += self._repeating(affected_month, month_length,
+                                   self.is_repeating)
+        return amounts
+
+    def month(self, year, month):
+        """Same as statistics(), (categories, repeaters) of a month."""
+        amounts = self.month_amounts(year, month)
+        known = self.known_category
+        sums = np.zeros(len(self.category_ids), dtype=np.int64)
+        np.add.at(sums, self.category_position[known], amounts[known])
+        categories = dict(zip(self.category_ids.tolist(), sums.tolist()))
+
+        repeater_ids = self.id[self.is_repeating & (amounts > 0)].tolist()
+        repeaters = []
+        if repeater_ids:
+            repeaters = self.db.query(Expense).filter(
+                Expense.id.in_(repeater_ids)).order_by(Expense.id).all()
+        return categories, repeaters
+
+
+def columnar_statistics(db, year, month):
+    """statistics() computed by a ColumnarStatistics engine."""
+    return ColumnarStatistics(db).month(year, month)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Compact, column oriented and compressed backup format.
+
+A file starts with the magic bytes and the format version, followed by
+the zlib compressed chunks of every table. Each chunk holds up to
+chunk_size rows column by column, every column prefixed by its length.
+The header at the end of the file lists row counts, crc32 checksums and
+the position of every chunk, so single tables can be read directly.
+Its position is stored in the last bytes of the file.
+"""
+
+from sqlalchemy import Integer, DateTime, Date, Float
+from array import array
+from datetime import datetime, date
+import json
+import struct
+import sys
+import zlib
+
+
+MAGIC = b'EXPC'
+VERSION = 1
+# header offset, header length, magic
+TRAILER = struct.Struct('<QI4s')
+LENGTH = struct.Struct('<I')
+MICROSECONDS_PER_DAY = 24 * 60 * 60 * 1000000
+
+
+class CompactBackupError(ValueError):
+    pass
+
+
+def is_compact(filename):
+    """Whether a backup file is in the compact format."""
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def column_kind(column):
+    if isinstance(column.type, DateTime):
+        return 'datetime'
+    if isinstance(column.type, Date):
+        return 'date'
+    if isinstance(column.type, Integer):
+        return 'int'
+    if isinstance(column.type, Float):
+        return 'float'
+    return 'str'
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _to_number(kind, value):
+    if kind == 'datetime':
+        time = (value.hour * 60 + value.minute) * 60 + value.second
+        return value.toordinal() * MICROSECONDS_PER_DAY + \
+            time * 1000000 + value.microsecond
+    if kind == 'date':
+        return value.toordinal()
+    return value
+
+
+def _from_number(kind, value):
+    if kind == 'datetime':
+        day, time = divmod(value, MICROSECONDS_PER_DAY)
+        seconds, microsecond = divmod(time, 1000000)
+        minutes, second = divmod(seconds, 60)
+        hour, minute = divmod(minutes, 60)
+        return datetime.fromordinal(day).replace(
+            hour=hour, minute=minute, second=second, microsecond=microsecond)
+    if kind == 'date':
+        return date.fromordinal(value)
+    return value
+
+
+def encode_column(kind, values):
+    """Null mask followed by fixed width numbers or length prefixed text."""
+    mask = bytes(value is None for value in values)
+    if kind == 'str':
+        encoded = [b'' if value is None else value.encode('utf-8')
+                   for value in values]
+        lengths = _little_endian(array('I', (len(x) for x in encoded)))
+        return mask + lengths.tobytes() + b''.join(encoded)
+    typecode = 'd' if kind == 'float' else 'q'
+    numbers = _little_endian(array(typecode, (
+        0 if value is None else _to_number(kind, value) for value in values)))
+    return mask + numbers.tobytes()
+
+
+def decode_column(kind, data, rows):
+    mask = data[:rows]
+    if kind == 'str':
+        lengths = array('I')
+        lengths.frombytes(data[rows:rows * 5])
+        _little_endian(lengths)
+        values = []
+        position = rows * 5
+        for is_null, length in zip(mask, lengths):
+            text = data[position:position + length]
+            position += length
+            values.append(None if is_null else text.decode('utf-8'))
+        return values
+    numbers = array('d' if kind == 'float' else 'q')
+    numbers.frombytes(data[rows:])
+    _little_endian(numbers)
+    return [None if is_null else _from_number(kind, value)
+            for is_null, value in zip(mask, numbers)]
+
+
+def encode_chunk(columns, rows):
+    parts = []
+    for key, kind in columns:
+        data = encode_column(kind, [row[key] for row in rows])
+        parts.append(LENGTH.pack(len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+
+def decode_chunk(columns, data, rows):
+    decoded = []
+    position = 0
+    for key, kind in columns:
+        (length,) = LENGTH.unpack_from(data, position)
+        position += LENGTH.size
+        decoded.append(decode_column(kind, data[position:position + length],
+                                     rows))
+        position += length
+    keys = [key for key, _ in columns]
+    return [dict(zip(keys, values)) for values in zip(*decoded)]
+
+
+def write_compact(f, tables, chunk_size=10000):
+    """Write (section, model, rows) tables to a binary file object."""
+    f.write(MAGIC + bytes([VERSION, 0, 0, 0]))
+    header = {'version': VERSION, 'tables': []}
+    for section, model, rows in tables:
+        columns = [(column.key, column_kind(column))
+                   for column in model.__table__.columns]
+        entry = {'section': section, 'table': model.__tablename__,
+                 'columns': columns, 'rows': 0, 'crc32': 0, 'chunks': []}
+
+        def flush(chunk):
+            data = encode_chunk(columns, chunk)
+            compressed = zlib.compress(data)
+            entry['chunks'].append([f.tell(), len(compressed), len(chunk)])
+            entry['rows'] += len(chunk)
+            entry['crc32'] = zlib.crc32(data, entry['crc32'])
+            f.write(compressed)
+
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+        header['tables'].append(entry)
+
+    offset = f.tell()
+    encoded = json.dumps(header).encode('utf-8')
+    f.write(encoded)
+    f.write(TRAILER.pack(offset, len(encoded), MAGIC))
+    return header
+
+
+def read_header(f):
+    """Header of a compact backup, lists tables, row counts and chunks."""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise CompactBackupError('not a compact backup')
+    version = f.read(4)[0]
+    if version > VERSION:
+        raise CompactBackupError(
+            'backup format version {} is not supported'.format(version))
+    f.seek(-TRAILER.size, 2)
+    offset, length, magic = TRAILER.unpack(f.read(TRAILER.size))
+    if magic != MAGIC:
+        raise CompactBackupError('backup file is truncated')
+    f.seek(offset)
+    return json.loads(f.read(length).decode('utf-8'))
+
+
+def read_table(f, entry):
+    """Yield the rows of one table of the header as dicts."""
+    columns = [tuple(column) for column in entry['columns']]
+    checksum = 0
+    for offset, length, rows in entry['chunks']:
+        f.seek(offset)
+        data = zlib.decompress(f.read(length))
+        checksum = zlib.crc32(data, checksum)
+        for row in decode_chunk(columns, data, rows):
+            yield row
+    if checksum != entry['crc32']:
+        raise CompactBackupError(
+            'checksum mismatch in table {}'.format(entry['table']))
@@ -1,19 +1,196 @@
-from requests import get
-from expenses.data_model import Expense, Category
+from sqlalchemy import func
+from expenses.data_model import Expense, Currency, Rate
+from expenses.reference_data import category_ids
+from expenses import instrumentation
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import calendar
 import datetime as dt
 
 
-def to_eur(amount, identifier, date):
+rate_api = 'https://api.fixer.io/{date}?symbols={symb}'
+request_timeout = 10
+
+# in-process LRU layer in front of the rates table
+cache_size = 4096
+_rate_cache = OrderedDict()
+cache_stats = {'history_hits': 0, 'hits': 0, 'db_hits': 0, 'misses': 0}
+
+# offline reference rates, answered before any cache or the api
+rate_history = None
+
+# one pooled connection to the api for the whole process
+_session = None
+
+
+def use_rate_history(history):
+    """Answer rate lookups from a RateHistory, None switches it off."""
+    global rate_history
+    rate_history = history
+
+
+def http_session():
+    """Shared requests session, keeps the connection to the api alive."""
+    global _session
+    if _session is None:
+        # only imported once a rate has to be fetched, it is slow to load
+        from requests import Session
+        _session = Session()
+    return _session
+
+
+def fetch_rates(date, identifiers):
+    """Ask the api for the rates of several currencies at one date."""
+    with instrumentation.timer('fx: fetch') as timing:
+        r = http_session().get(
+            rate_api.format(date=date.strftime('%Y-%m-%d'),
+                            symb=','.join(identifiers)),
+            timeout=request_timeout)
+        r.raise_for_status()
+        timing.items = len(identifiers)
+    rates = r.json()['rates']
+    return {identifier: rates[identifier] for identifier in identifiers}
+
+
+def fetch_rate(identifier, date):
+    """Ask the api for the rate of a currency at a date."""
+    return fetch_rates(date, [identifier])[identifier]
+
+
+def _as_day(date):
+    if isinstance(date, dt.datetime):
+        return date.date()
+    return date
+
+
+def _remember_rate(key, rate):
+    _rate_cache[key] = rate
+    _rate_cache.move_to_end(key)
+    if len(_rate_cache) > cache_size:
+        _rate_cache.popitem(last=False)
+
+
+def _known_rate(identifier, day, db):
+    """Rate from the history or one of the cache layers, None on a miss."""
+    if rate_history is not None:
+        rate = rate_history.lookup(identifier, day)
+        if rate is not None:
+            cache_stats['history_hits'] += 1
+            instrumentation.count('fx: history hit')
+            return rate
+
+    key = (day, identifier)
+    if key in _rate_cache:
+        _rate_cache.move_to_end(key)
+        cache_stats['hits'] += 1
+        instrumentation.count('fx: cache hit')
+        return _rate_cache[key]
+
+    if db is not None:
+        stored = db.query(Rate.rate).filter(Rate.day == day,
+                                            Rate.identifier == identifier)\
+            .first()
+        if stored is not None:
+            cache_stats['db_hits'] += 1
+            instrumentation.count('fx: database hit')
+            _remember_rate(key, stored[0])
+            return stored[0]
+    return None
+
+
+def _store_rate(identifier, day, rate, db):
+    cache_stats['misses'] += 1
+    instrumentation.count('fx: miss')
+    _remember_rate((day, identifier), rate)
+    if db is not None:
+        # committed together with the expense that needed it
+        db.add(Rate(day=day, identifier=identifier, rate=rate))
+
+
+def known_rate(identifier, date, db=None):
+    """Rate if it is known without asking the api, None otherwise."""
+    return _known_rate(identifier, _as_day(date), db)
+
+
+def store_rate(identifier, date, rate, db=None):
+    """Remember a rate fetched elsewhere, like on another thread."""
+    _store_rate(identifier, _as_day(date), rate, db)
+
+
+def get_rate(identifier, date, db=None):
+    """Exchange rate of a currency at a date (1 EUR = rate * currency).
+
+    Uses the offline rate history if one is loaded, then looks into the
+    in-process cache and the rates table of db. Only on a miss the api is
+    asked, the answer is stored in both cache layers.
+    """
+    day = _as_day(date)
+    rate = _known_rate(identifier, day, db)
+    if rate is None:
+        rate = fetch_rate(identifier, day)
+        _store_rate(identifier, day, rate, db)
+    return rate
+
+
+def cache_info():
+    """Hit and miss counters of the rate cache."""
+    info = dict(cache_stats)
+    info['size'] = len(_rate_cache)
+    return info
+
+
+def clear_rate_cache():
+    """Empty the in-process rate cache and reset its counters."""
+    _rate_cache.clear()
+    for key in cache_stats:
+        cache_stats[key] = 0
+
+
+def to_eur(amount, identifier, date, db=None):
     if identifier == 'EUR':
         return amount
-    date_string = date.strftime('%Y-%m-%d')
-    r = get('https://api.fixer.io/{date}?symbols={symb}'.format(
-        date=date_string, symb=identifier))
-    rate = r.json()['rates'][identifier]
+    rate = get_rate(identifier, date, db=db)
     return round(amount / rate)
 
 
+def to_eur_many(items, db=None, max_workers=4):
+    """Convert many (amount, identifier, date) triples, keeps their order.
+
+    Every (date, identifier) pair is resolved only once. All rates missing
+    for one day are fetched with a single request and the days are fetched
+    concurrently on a bounded pool sharing the api session.
+    """
+    items = list(items)
+    rates = {}
+    missing = {}
+    for _, identifier, date in items:
+        if identifier == 'EUR':
+            continue
+        day = _as_day(date)
+        if (day, identifier) in rates or identifier in missing.get(day, ()):
+            continue
+        rate = _known_rate(identifier, day, db)
+        if rate is None:
+            missing.setdefault(day, set()).add(identifier)
+        else:
+            rates[(day, identifier)] = rate
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            days = list(missing)
+            fetched = pool.map(
+                lambda day: fetch_rates(day, sorted(missing[day])), days)
+            # the database session is only touched from this thread
+            for day, day_rates in zip(days, fetched):
+                for identifier, rate in day_rates.items():
+                    _store_rate(identifier, day, rate, db)
+                    rates[(day, identifier)] = rate
+
+    return [amount if identifier == 'EUR'
+            else round(amount / rates[(_as_day(date), identifier)])
+            for amount, identifier, date in items]
+
+
 def amount_in_month(start_month, start_date, end_month, end_date,
                     end_of_month, total_amount):
     affected_month = end_of_month.year * 12 + end_of_month.month
@@ -60,58 +237,177 @@ def fractional_expense(item, end_of_month, debug):
     return amount
 
 
+def _occurrences(step, offset, low, high):
+    """Count k >= 0 with low <= offset - k * step <= high."""
+    if high < low:
+        return 0
+    first = max(0, -((high - offset) // step))
+    last = (offset - low) // step
+    return max(0, last - first + 1)
+
+
 def repeating_expense(item, end_of_month):
     step = item.repeat_interval
+    if step < 1:
+        raise ValueError('repeat interval has to be at least one month')
 
     affected_month = end_of_month.year * 12 + end_of_month.month
     start_month = item.issued.year * 12 + item.issued.month
     if item.end is not None:
-        end_month = item.end.year * 12 + item.end.month
+        duration = item.end.year * 12 + item.end.month - start_month
         end_date = item.end
     else:
-        end_month = start_month
+        duration = 0
         end_date = item.issued
+    if duration < 0:
+        return 0
 
-    # stuff to calculate fractional amount
-
-    amount = 0
-    while start_month <= affected_month:
-        amount += amount_in_month(start_month, item.issued, end_month,
-                                  end_date, end_of_month, item.in_eur)
+    # the k-th repetition covers the months start_month + k * step up to
+    # start_month + k * step + duration, so whether and how it counts into
+    # the affected month only depends on how many months earlier it began
+    offset = affected_month - start_month
+    month_length = end_of_month.day
+    total_days = (end_date - item.issued).days + 1
 
-        start_month += step
-        end_month += step
+    def share(low, high, in_month):
+        count = _occurrences(step, offset, low, high)
+        if count == 0:
+            return 0
+        return count * round(1.0 * in_month / total_days * item.in_eur)
 
+    if duration == 0:
+        # time span lays totally in month
+        return share(0, 0, total_days)
+    # begins in month, ends after month
+    amount = share(0, 0, max(month_length - item.issued.day, 0))
+    # begins and ends outside of month
+    amount += share(1, duration - 1, month_length)
+    # begins before month, ends in month
+    amount += share(duration, duration, min(month_length, end_date.day))
     return amount
 
 
-def statistics(db, year, month, debug=False):
-    categories = {x.id: 0 for x in db.query(Category).all()}
-
+def month_bounds(year, month):
+    """First and last day of a month, as used by the statistics queries."""
     max_day = calendar.monthrange(year, month)[1]
-    start_of_month = dt.datetime(year, month, 1)
-    end_of_month = dt.datetime(year, month, max_day)
-    # simple expenses which count into this month
-    for item in db.query(Expense).filter(
-            Expense.end.is_(None), Expense.repeat_interval.is_(None),
-            Expense.issued >= start_of_month,
-            Expense.issued <= end_of_month):
-        categories[item.category_id] += item.in_eur
+    return dt.datetime(year, month, 1), dt.datetime(year, month, max_day)
+
+
+def simple_totals(db, start_of_month, end_of_month):
+    """Sum of simple expenses in a month, as (category_id, sum) rows."""
+    return db.query(Expense.category_id, func.sum(Expense.in_eur)).filter(
+        Expense.end.is_(None), Expense.repeat_interval.is_(None),
+        Expense.issued >= start_of_month,
+        Expense.issued <= end_of_month).group_by(Expense.category_id)
+
+
+def long_term_expenses(db, start_of_month, end_of_month):
+    # expenses waiting for their conversion have no in_eur yet
+    return db.query(Expense).filter(
+        Expense.end.isnot(None), Expense.repeat_interval.is_(None),
+        Expense.issued <= end_of_month,
+        Expense.end >= start_of_month, Expense.in_eur.isnot(None))
+
+
+def repeating_expenses(db):
+    return db.query(Expense).filter(Expense.repeat_interval.isnot(None),
+                                    Expense.in_eur.isnot(None))
+
+
+# the fields the month functions read, in_eur set to the original price
+_Priced = namedtuple('_Priced', ['issued', 'end', 'repeat_interval',
+                                 'in_eur'])
+
+
+def pending_amounts(db, year, month):
+    """Amounts of a month still waiting for conversion, per currency.
+
+    Amounts are in cents of the original currency, allocated to the month
+    as statistics() would after the conversion.
+    """
+    start_of_month, end_of_month = month_bounds(year, month)
+    amounts = {}
+    for item, identifier in db.query(Expense, Currency.identifier)\
+            .join(Currency, Expense.currency_id == Currency.id)\
+            .filter(Expense.in_eur.is_(None)):
+        priced = _Priced(item.issued, item.end, item.repeat_interval,
+                         item.price)
+        if item.repeat_interval is not None:
+            amount = repeating_expense(priced, end_of_month)
+        elif item.end is None:
+            amount = item.price if \
+                start_of_month <= item.issued <= end_of_month else 0
+        elif item.issued <= end_of_month and item.end >= start_of_month:
+            amount = fractional_expense(priced, end_of_month, False)
+        else:
+            amount = 0
+        if amount:
+            amounts[identifier] = amounts.get(identifier, 0) + amount
+    return amounts
+
+
+def statistics(db, year, month, debug=False, with_pending=False):
+    """Amount per category and the repeating expenses of a month.
+
+    Expenses waiting for their conversion are left out. with_pending adds
+    their amounts per currency, as given by pending_amounts().
+    """
+    categories = {x: 0 for x in category_ids(db)}
+
+    start_of_month, end_of_month = month_bounds(year, month)
+    # simple expenses which count into this month, summed up by sqlite
+    with instrumentation.timer('statistics: simple'):
+        for category_id, amount in simple_totals(db, start_of_month,
+                                                 end_of_month):
+            categories[category_id] += amount or 0
 
     # long term expenses
-    for item in db.query(Expense).filter(
-            Expense.end.isnot(None), Expense.repeat_interval.is_(None),
-            Expense.issued <= end_of_month,
-            Expense.end >= start_of_month):
-        amount = fractional_expense(item, end_of_month, debug)
-        categories[item.category_id] += amount
+    with instrumentation.timer('statistics: long term') as timing:
+        items = long_term_expenses(db, start_of_month, end_of_month).all()
+        for item in items:
+            amount = fractional_expense(item, end_of_month, debug)
+            categories[item.category_id] += amount
+        timing.items = len(items)
 
     # repeating expenses
     repeaters = []
-    for item in db.query(Expense).filter(Expense.repeat_interval.isnot(None)):
-        amount = repeating_expense(item, end_of_month)
-        categories[item.category_id] += amount
-        if amount > 0:
-            repeaters.append(item)
+    with instrumentation.timer('statistics: repeating') as timing:
+        items = repeating_expenses(db).all()
+        for item in items:
+            amount = repeating_expense(item, end_of_month)
+            categories[item.category_id] += amount
+            if amount > 0:
+                repeaters.append(item)
+        timing.items = len(items)
 
+    if with_pending:
+        return categories, repeaters, pending_amounts(db, year, month)
     return categories, repeaters
+
+
+def explain_query(db, query):
+    """Steps of the sqlite query plan of a query."""
+    connection = db.connection()
+    compiled = query.statement.compile(dialect=connection.dialect)
+    # the values do not change the plan, plain strings are enough
+    params = [compiled.params[name] for name in compiled.positiontup]
+    params = [str(x) if isinstance(x, dt.datetime) else x for x in params]
+    cursor = connection.connection.cursor()
+    cursor.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)
+    plan = [row[-1] for row in cursor.fetchall()]
+    cursor.close()
+    return plan
+
+
+def explain_statistics(db, year, month):
+    """Query plans of the queries statistics() runs for a month."""
+    start_of_month, end_of_month = month_bounds(year, month)
+    return [
+        ('simple expenses',
+         explain_query(db, simple_totals(db, start_of_month,
+                                         end_of_month))),
+        ('long term expenses',
+         explain_query(db, long_term_expenses(db, start_of_month,
+                                              end_of_month))),
+        ('repeating expenses', explain_query(db, repeating_expenses(db))),
+    ]
@@ -1,29 +1,170 @@
 # -*- coding: utf-8 -*-
 """Handling and Connection to data sources."""
 
-from sqlalchemy import create_engine, MetaData
-from expenses.data_model import Base, Currency, Category, Expense
+from sqlalchemy import create_engine, inspect, event, DateTime
+from expenses.data_model import Base, Currency, Category, Expense,\
+    PendingConversion
+from expenses import compact_backup, instrumentation
+from expenses.reference_data import invalidate_reference_data
 from sqlalchemy.orm import sessionmaker
 import json
+import re
+import time
+import hashlib
+import hmac
 from datetime import datetime
-from os import path, makedirs, listdir, remove
-
-
-def get_engine(name, password):
-    """Get sqlite engine."""
-    password_connector = ['', '']
+from os import path, makedirs, listdir, remove, replace, fdopen, close
+from tempfile import mkstemp
+from shutil import copyfile
+from urllib.parse import urlencode
+import sqlite3
+
+
+# pragmas accepted from the config, applied on every new connection
+allowed_pragmas = ['journal_mode', 'synchronous', 'cache_size', 'mmap_size',
+                   'temp_store', 'busy_timeout']
+recommended_pragmas = {'journal_mode': 'WAL',
+                       'synchronous': 'NORMAL',
+                       'cache_size': -16000,
+                       'mmap_size': 64 * 1024 * 1024,
+                       'temp_store': 'MEMORY'}
+
+# sqlcipher settings a database is created with, needed on every connect
+cipher_settings = ['kdf_iter', 'cipher_page_size']
+# defaults of SQLCipher 4
+default_kdf_iter = 256000
+default_cipher_page_size = 4096
+
+# one engine per database, key, pragmas and cipher settings
+_engines = {}
+
+
+def pragma_statements(pragmas):
+    """PRAGMA statements for a dict of pragmas, checks names and values."""
+    statements = []
+    for name, value in sorted(pragmas.items()):
+        if name not in allowed_pragmas:
+            raise ValueError('pragma {} is not supported'.format(name))
+        if not re.match(r'^-?[A-Za-z0-9_]+$', str(value)):
+            raise ValueError('invalid value for pragma {}: {}'.format(
+                name, value))
+        statements.append('PRAGMA {}={}'.format(name, value))
+    return statements
+
+
+def get_engine(name, password, pragmas=None, cipher=None):
+    """Get sqlite engine, created once per database, key and settings.
+
+    password can also be a raw key as made by raw_key_string, which skips
+    the key derivation of SQLCipher. cipher holds the kdf_iter and
+    cipher_page_size the database was created with.
+    """
+    pragmas = pragmas or {}
+    cipher = cipher or {}
+    key = (name, password, tuple(sorted(pragmas.items())),
+           tuple(sorted(cipher.items())))
+    if key in _engines:
+        if instrumentation.enabled:
+            instrumentation.instrument_engine(_engines[key])
+        return _engines[key]
+
+    password_connector = ['', '/']
     if password is not None:
         password_connector[0] = '+pysqlcipher'
         password_connector[1] = ':{}@/'.format(password)
     connector = 'sqlite{pw[0]}://{pw[1]}{name}'.format(
         pw=password_connector, name=name)
+    if password is not None and cipher:
+        # the pysqlcipher dialect sets these right after the key
+        for setting in cipher:
+            if setting not in cipher_settings:
+                raise ValueError('cipher setting {} is not supported'
+                                 .format(setting))
+        connector += '?' + urlencode(sorted(cipher.items()))
+
+    engine = create_engine(connector, echo=False)
+    statements = pragma_statements(pragmas)
+    if statements:
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(connection, connection_record):
+            cursor = connection.cursor()
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.close()
+
+    if instrumentation.enabled:
+        instrumentation.instrument_engine(engine)
+    _engines[key] = engine
+    return engine
+
+
+def drop_engine(name, password):
+    """Close and forget all engines of a database and key."""
+    for key in list(_engines):
+        if key[:2] == (name, password):
+            _engines.pop(key).dispose()
+
+
+def derive_raw_key(name, password, kdf_iter=default_kdf_iter):
+    """Key SQLCipher 4 derives from a password for an existing database.
+
+    PBKDF2-HMAC-SHA512 over the salt in the first 16 bytes of the file.
+    """
+    with open(name, 'rb') as f:
+        salt = f.read(16)
+    return hashlib.pbkdf2_hmac('sha512', password.encode('utf-8'), salt,
+                               kdf_iter, 32)
+
+
+def raw_key_string(key):
+    """Raw key in the form SQLCipher accepts instead of a password."""
+    return "x'{}'".format(key.hex().upper())
+
 
-    return create_engine(connector, echo=False)
+def salted_raw_key(name, password):
+    """A raw key string with the salt of database name, others unchanged.
+
+    A raw key alone makes SQLCipher pick a new random salt for a new
+    database, the password would no longer derive its key.
+    """
+    if not re.match(r"^x'[0-9A-Fa-f]{64}'$", password):
+        return password
+    with open(name, 'rb') as f:
+        salt = f.read(16)
+    return password[:-1] + salt.hex().upper() + "'"
 
 
-def db_create(name, password=None):
+def check_key(name, key, cipher_page_size=default_cipher_page_size):
+    """Check a raw key against the HMAC of the first database page.
+
+    Costs two PBKDF2 iterations instead of a full key derivation.
+    """
+    with open(name, 'rb') as f:
+        page = f.read(cipher_page_size)
+    if len(page) < cipher_page_size:
+        return False
+    salt = page[:16]
+    hmac_salt = bytes(x ^ 0x3a for x in salt)
+    hmac_key = hashlib.pbkdf2_hmac('sha512', key, hmac_salt, 2, 32)
+    # HMAC-SHA512 over the page after the salt, including its IV, and the
+    # little endian page number
+    expected = hmac.new(hmac_key, page[16:-64] + (1).to_bytes(4, 'little'),
+                        hashlib.sha512).digest()
+    return hmac.compare_digest(expected, page[-64:])
+
+
+def check_password(name, password, kdf_iter=default_kdf_iter,
+                   cipher_page_size=default_cipher_page_size):
+    """Raw key string of a password, None if the password is wrong."""
+    key = derive_raw_key(name, password, kdf_iter)
+    if not check_key(name, key, cipher_page_size):
+        return None
+    return raw_key_string(key)
+
+
+def db_create(name, password=None, cipher=None):
     """Fill empty database with data model and initial data."""
-    engine = get_engine(name, password)
+    engine = get_engine(name, password, cipher=cipher)
 
     # create data model
     Base.metadata.create_all(engine)
@@ -37,9 +178,9 @@ def db_create(name, password=None):
     db.close()
 
 
-def db_connect(name, password=None):
+def db_connect(name, password=None, pragmas=None, cipher=None):
     """Open a connection to the database."""
-    engine = get_engine(name, password)
+    engine = get_engine(name, password, pragmas, cipher)
 
     Session = sessionmaker(bind=engine)
     db = Session()
@@ -47,6 +188,26 @@ def db_connect(name, password=None):
     return db
 
 
+def db_upgrade(db):
+    """Add tables and indexes of newer versions of the data model.
+
+    Returns the names of the tables that had to be created.
+    """
+    engine = db.get_bind()
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    Base.metadata.create_all(engine)
+
+    # create_all skips tables that exist, so add their new indexes here
+    for table in Base.metadata.sorted_tables:
+        existing = set(x['name'] for x in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+    return [table.name for table in Base.metadata.sorted_tables
+            if table.name not in existing_tables]
+
+
 def db_disconnect(db):
     """Close database connection."""
     db.commit()
@@ -73,6 +234,15 @@ def standard_data():
 # define format strings
 backup_timestring = '%Y-%m-%dT%H:%M:%SZ'
 backup_filename = "backup_%Y%m%dT%H%M.expense"
+delta_filename = "backup_%Y%m%dT%H%M.delta"
+snapshot_filename = "backup_%Y%m%dT%H%M.snapshot"
+backup_state_filename = 'backup_state.json'
+manifest_filename = 'manifest.json'
+
+# sections of a backup file, in the order they are written and restored
+backup_tables = [('Currencies', Currency),
+                 ('Categories', Category),
+                 ('Expenses', Expense)]
 
 
 def datetime_serializer(obj):
@@ -99,135 +269,562 @@ def datetime_parser(obj):
     return obj
 
 
-def write_backup(db, backup_directory):
-    """Create a JSON serialized backup of all the data in the db."""
-    def dump_object(item):
-        """Return JSON dict of non-internal fields in object."""
-        allowed_types = [str, int, datetime, None]
-        fields = [x for x in dir(item)
-                  if (not x.startswith('_') and
-                      x != 'metadata' and
-                      type(getattr(item, x)) in allowed_types)]
-        item_dict = {field: getattr(item, field) for field in fields}
-        return json.dumps(item_dict, default=datetime_serializer)
-
-    backup = ""
-
-    backup += "Currencies\n"
-    for item in db.query(Currency):
-        backup += dump_object(item) + '\n'
-
-    backup += "Categories\n"
-    for item in db.query(Category):
-        backup += dump_object(item) + '\n'
+def table_rows(db, model, chunk_size=1000):
+    """Stream the mapped columns of all rows of a table as dicts."""
+    columns = list(model.__table__.columns)
+    keys = [column.key for column in columns]
+    for row in db.query(*columns).yield_per(chunk_size):
+        yield dict(zip(keys, row))
 
-    backup += "Expenses\n"
-    for item in db.query(Expense):
-        backup += dump_object(item) + '\n'
 
-    filename = path.join(backup_directory,
-                         datetime.today().strftime(backup_filename))
+def write_backup(db, backup_directory, chunk_size=1000,
+                 backup_format='json'):
+    """Create a backup of all the data in the db.
 
+    backup_format is 'json' for one JSON object per line or 'compact' for
+    the compressed binary format of expenses.compact_backup. Rows are
+    streamed into a temporary file which only replaces the backup file once
+    it is complete. Returns the path of the backup.
+    """
+    started = time.perf_counter()
     # create backup directory if necessary
     if not path.exists(backup_directory):
         makedirs(backup_directory)
 
-    f = open(filename, 'w')
-    f.write(backup)
-    f.close()
-
-
-def load_backup(db, filename, backup_directory):
-    """Clear database and recreate from backup."""
+    now = datetime.today()
+    filename = path.join(backup_directory, now.strftime(backup_filename))
+    rows = {}
+    handle, temporary = mkstemp(dir=backup_directory, suffix='.tmp')
+    try:
+        if backup_format == 'compact':
+            with fdopen(handle, 'wb') as f:
+                header = compact_backup.write_compact(
+                    f, [(section, model, table_rows(db, model, chunk_size))
+                        for section, model in backup_tables])
+            rows = {x['section']: x['rows'] for x in header['tables']}
+        else:
+            with fdopen(handle, 'w') as f:
+                for section, model in backup_tables:
+                    f.write(section + '\n')
+                    rows[section] = 0
+                    for row in table_rows(db, model, chunk_size):
+                        f.write(json.dumps(row,
+                                           default=datetime_serializer))
+                        f.write('\n')
+                        rows[section] += 1
+        replace(temporary, filename)
+    except BaseException:
+        remove(temporary)
+        raise
+    record_backup(backup_directory, filename, now, backup_format, rows)
+    instrumentation.add('backup: write ' + backup_format,
+                        time.perf_counter() - started, sum(rows.values()))
+    return filename
+
+
+def backup_format(filename):
+    """'snapshot', 'delta', 'compact' or 'json', depending on a file."""
+    if filename.endswith('.snapshot'):
+        return 'snapshot'
+    if filename.endswith('.delta'):
+        return 'delta'
+    if compact_backup.is_compact(filename):
+        return 'compact'
+    return 'json'
+
+
+def _file_checksum(filename):
+    checksum = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def _write_json(filename, content):
+    """Replace a JSON file atomically."""
+    handle, temporary = mkstemp(dir=path.dirname(filename) or '.',
+                                suffix='.tmp')
+    with fdopen(handle, 'w') as f:
+        json.dump(content, f)
+    replace(temporary, filename)
+
+
+def _scan_backups(backup_directory):
+    """Manifest entries for the backup files found in a directory."""
+    backups = {}
+    for filename in listdir(backup_directory):
+        name_format = backup_filename
+        if filename.endswith('.delta'):
+            name_format = delta_filename
+        elif filename.endswith('.snapshot'):
+            name_format = snapshot_filename
+        try:
+            time = datetime.strptime(filename, name_format)
+        except ValueError:
+            continue
+        full_path = path.join(backup_directory, filename)
+        entry = {'timestamp': time.strftime(backup_timestring),
+                 'size': path.getsize(full_path),
+                 'format': backup_format(full_path),
+                 'rows': None,
+                 'checksum': _file_checksum(full_path)}
+        if entry['format'] == 'delta':
+            entry['base'] = delta_base(full_path)
+        backups[filename] = entry
+    return backups
+
+
+def load_manifest(backup_directory):
+    """Metadata of all backups in a directory, by file name.
+
+    The manifest is created from the files in the directory if missing.
+    """
+    filename = path.join(backup_directory, manifest_filename)
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)['backups']
+    except (OSError, ValueError, KeyError):
+        pass
+    if not path.exists(backup_directory):
+        return {}
+    backups = _scan_backups(backup_directory)
+    _write_json(filename, {'backups': backups})
+    return backups
+
+
+def record_backup(backup_directory, filename, time, backup_format, rows,
+                  base=None):
+    """Add a newly written backup file to the manifest."""
+    backups = load_manifest(backup_directory)
+    entry = {'timestamp': time.strftime(backup_timestring),
+             'size': path.getsize(filename),
+             'format': backup_format,
+             'rows': rows,
+             'checksum': _file_checksum(filename)}
+    if base is not None:
+        entry['base'] = base
+    backups[path.basename(filename)] = entry
+    _write_json(path.join(backup_directory, manifest_filename),
+                {'backups': backups})
+
+
+def list_backups(backup_directory):
+    """(file name, metadata) of all backups, newest first."""
+    backups = load_manifest(backup_directory)
+    return sorted(backups.items(), key=lambda x: x[1]['timestamp'],
+                  reverse=True)
+
+
+def write_snapshot(db, backup_directory, password=None, cipher=None):
+    """Copy the database page by page into a snapshot file.
+
+    Plain databases are copied with the sqlite online backup API,
+    encrypted ones are exported into an equally encrypted file with
+    sqlcipher_export. Returns the path of the snapshot.
+    """
+    started = time.perf_counter()
+    if not path.exists(backup_directory):
+        makedirs(backup_directory)
     db.commit()
 
-    # clear database
-    meta = MetaData()
-    for table in reversed(meta.sorted_tables):
-        db.execute(table.delete())
+    now = datetime.today()
+    filename = path.join(backup_directory, now.strftime(snapshot_filename))
+    handle, temporary = mkstemp(dir=backup_directory, suffix='.tmp')
+    close(handle)
+    try:
+        connection = db.connection().connection
+        if password is None:
+            target = sqlite3.connect(temporary)
+            try:
+                connection.backup(target)
+            finally:
+                target.close()
+        else:
+            cursor = connection.cursor()
+            # same salt, so the password still opens the snapshot
+            key = salted_raw_key(db.get_bind().url.database, password)
+            cursor.execute('ATTACH DATABASE ? AS snapshot KEY ?',
+                           (temporary, key))
+            # same settings as the database, not the sqlcipher defaults
+            for setting, value in sorted((cipher or {}).items()):
+                cursor.execute('PRAGMA snapshot.{}={:d}'.format(setting,
+                                                               int(value)))
+            cursor.execute("SELECT sqlcipher_export('snapshot')")
+            cursor.execute('DETACH DATABASE snapshot')
+            cursor.close()
+        replace(temporary, filename)
+    except BaseException:
+        remove(temporary)
+        raise
+
+    rows = {section: db.query(model).count()
+            for section, model in backup_tables}
+    record_backup(backup_directory, filename, now, 'snapshot', rows)
+    instrumentation.add('backup: write snapshot',
+                        time.perf_counter() - started, sum(rows.values()))
+    return filename
+
+
+def restore_snapshot(filename, backup_directory, name):
+    """Replace the database file name by a snapshot.
+
+    All connections to the database have to be closed before, e.g. with
+    db_disconnect, and opened again afterwards.
+    """
+    snapshot = path.join(backup_directory, filename)
+    handle, temporary = mkstemp(dir=path.dirname(path.abspath(name)),
+                                suffix='.tmp')
+    close(handle)
+    try:
+        copyfile(snapshot, temporary)
+        # journal files of the old database do not belong to the snapshot
+        for suffix in ('-wal', '-shm', '-journal'):
+            if path.exists(name + suffix):
+                remove(name + suffix)
+        replace(temporary, name)
+    except BaseException:
+        remove(temporary)
+        raise
+
+
+def _row_hash(row):
+    encoded = json.dumps(row, default=datetime_serializer, sort_keys=True)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+def load_backup_state(backup_directory):
+    """Hashes of the last full backup, None if there is no usable one."""
+    try:
+        with open(path.join(backup_directory, backup_state_filename)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not path.exists(path.join(backup_directory, state['base'])):
+        return None
+    return state
+
+
+def _write_backup_state(backup_directory, state):
+    _write_json(path.join(backup_directory, backup_state_filename), state)
+
+
+def write_incremental_backup(db, backup_directory, chunk_size=1000,
+                             backup_format='json', max_delta=0.5):
+    """Write only what changed since the last full backup.
+
+    Nothing is written if the data did not change since the last backup.
+    Otherwise a delta file with all rows added, changed or deleted since
+    the last full backup is written, chained to it. A full backup is
+    written instead if there is none yet, it is from an earlier month or
+    more than max_delta of the rows changed.
+    Returns the path of the new file or None.
+    """
+    started = time.perf_counter()
+    if not path.exists(backup_directory):
+        makedirs(backup_directory)
+    state = load_backup_state(backup_directory)
+    now = datetime.today()
+    if state is not None and \
+            datetime.strptime(state['base'], backup_filename).strftime(
+                '%Y%m') != now.strftime('%Y%m'):
+        # every month starts with a full backup
+        state = None
+
+    # rows are only collected for the delta while it stays small enough
+    limit = max_delta * sum(db.query(model).count()
+                            for _, model in backup_tables)
+    digest = hashlib.sha1()
+    hashes = {}
+    changed = []
+    deleted = []
+    change_count = 0
+    for section, model in backup_tables:
+        base = {} if state is None else state['rows'].get(section, {})
+        hashes[section] = {}
+        for row in table_rows(db, model, chunk_size):
+            row_hash = _row_hash(row)
+            key = str(row['id'])
+            hashes[section][key] = row_hash
+            digest.update(row_hash.encode('ascii'))
+            if base.get(key) != row_hash:
+                change_count += 1
+                if change_count <= limit:
+                    changed.append((section, row))
+        digest.update(section.encode('ascii'))
+        deleted.extend((section, int(key)) for key in base
+                       if key not in hashes[section])
+    digest = digest.hexdigest()
+    instrumentation.add('backup: compare with last backup',
+                        time.perf_counter() - started,
+                        sum(len(x) for x in hashes.values()))
+
+    if state is not None and state['hash'] == digest:
+        # nothing changed since the last backup
+        return None
+
+    if state is None or change_count + len(deleted) > limit:
+        filename = write_backup(db, backup_directory, chunk_size,
+                                backup_format)
+        _write_backup_state(backup_directory, {
+            'base': path.basename(filename), 'hash': digest,
+            'rows': hashes})
+        return filename
+
+    filename = path.join(backup_directory, now.strftime(delta_filename))
+    handle, temporary = mkstemp(dir=backup_directory, suffix='.tmp')
+    try:
+        with fdopen(handle, 'w') as f:
+            f.write('Base\n')
+            f.write(json.dumps({'base': state['base']}) + '\n')
+            for section, _ in backup_tables:
+                f.write(section + '\n')
+                for row_section, row in changed:
+                    if row_section == section:
+                        f.write(json.dumps(row, default=datetime_serializer))
+                        f.write('\n')
+            f.write('Deleted\n')
+            for section, key in deleted:
+                f.write(json.dumps({'section': section, 'id': key}) + '\n')
+        replace(temporary, filename)
+    except BaseException:
+        remove(temporary)
+        raise
+    rows = {section: sum(1 for x, _ in changed if x == section)
+            for section, _ in backup_tables}
+    rows['Deleted'] = len(deleted)
+    record_backup(backup_directory, filename, now, 'delta', rows,
+                  base=state['base'])
+    state['hash'] = digest
+    _write_backup_state(backup_directory, state)
+    return filename
+
+
+def row_decoder(model):
+    """Parse backup lines of a table, only its datetime columns are parsed.
+
+    Columns missing in the line, as in backups of older versions, are None.
+    """
+    keys = [column.key for column in model.__table__.columns]
+    datetime_keys = [column.key for column in model.__table__.columns
+                     if isinstance(column.type, DateTime)]
+
+    def decode(line):
+        row = dict.fromkeys(keys)
+        row.update(json.loads(line))
+        for key in datetime_keys:
+            if row[key] is not None:
+                row[key] = datetime.strptime(row[key], backup_timestring)
+        return row
+    return decode
+
+
+def clear_backup_tables(db):
+    """Delete all rows of the tables in a backup, dependent tables first."""
+    for _, model in reversed(backup_tables):
+        db.execute(model.__table__.delete())
+
+
+def insert_rows(db, model, rows):
+    """Insert a chunk of row dicts with a single executemany."""
+    if rows:
+        db.execute(model.__table__.insert(), rows)
+
+
+def _insert_chunked(db, model, rows, chunk_size):
+    count = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            insert_rows(db, model, chunk)
+            count += len(chunk)
+            chunk = []
+    insert_rows(db, model, chunk)
+    return count + len(chunk)
+
+
+def _load_json(db, filename, chunk_size):
+    sections = {section + '\n': model for section, model in backup_tables}
+    restored = 0
+    with open(filename, 'r') as f:
+        model = None
+        chunk = []
+        for line in f:
+            if line in sections:
+                insert_rows(db, model, chunk)
+                restored += len(chunk)
+                chunk = []
+                model = sections[line]
+                decode = row_decoder(model)
+                continue
+            chunk.append(decode(line))
+            if len(chunk) >= chunk_size:
+                insert_rows(db, model, chunk)
+                restored += len(chunk)
+                chunk = []
+        insert_rows(db, model, chunk)
+        restored += len(chunk)
+    return restored
+
+
+def _load_compact(db, filename, chunk_size):
+    sections = dict(backup_tables)
+    restored = 0
+    with open(filename, 'rb') as f:
+        header = compact_backup.read_header(f)
+        # restore in the order of backup_tables, whatever the file order
+        entries = {entry['section']: entry for entry in header['tables']}
+        for section, model in backup_tables:
+            if section in entries:
+                restored += _insert_chunked(
+                    db, sections[section],
+                    compact_backup.read_table(f, entries[section]),
+                    chunk_size)
+    return restored
+
+
+def delta_base(filename):
+    """File name of the full backup a delta file is chained to."""
+    with open(filename, 'r') as f:
+        if f.readline() != 'Base\n':
+            raise ValueError('{} is not a delta backup'.format(filename))
+        return json.loads(f.readline())['base']
 
-    db.query(Expense).delete()
-    db.query(Currency).delete()
-    db.query(Category).delete()
 
-    db.commit()
-    db.flush()
+def _delete_ids(db, model, ids, chunk_size):
+    table = model.__table__
+    for i in range(0, len(ids), chunk_size):
+        db.execute(table.delete().where(
+            table.c.id.in_(ids[i:i + chunk_size])))
 
-    # now open backup
-    filename = path.join(backup_directory, filename)
 
-    # load data
+def _apply_delta(db, filename, chunk_size):
+    sections = {section + '\n': model for section, model in backup_tables}
+    models = dict(backup_tables)
+    changed = {}
+    deleted = {}
     with open(filename, 'r') as f:
-        current_class = None
+        current = None
         for line in f:
-            if line == "Currencies\n":
-                current_class = Currency
-            elif line == "Expenses\n":
-                current_class = Expense
-            elif line == "Categories\n":
-                current_class = Category
-            else:
-                new_object = current_class(**json.loads(line,
-                                           object_hook=datetime_parser))
-                db.add(new_object)
-    db.flush()
-
+            if line in sections or line in ('Base\n', 'Deleted\n'):
+                current = line
+            elif current in sections:
+                row = row_decoder(sections[current])(line)
+                changed.setdefault(sections[current], []).append(row)
+            elif current == 'Deleted\n':
+                entry = json.loads(line)
+                deleted.setdefault(models[entry['section']], []).append(
+                    entry['id'])
+
+    restored = 0
+    for _, model in backup_tables:
+        rows = changed.get(model, [])
+        _delete_ids(db, model, [row['id'] for row in rows] +
+                    deleted.get(model, []), chunk_size)
+        restored += _insert_chunked(db, model, rows, chunk_size)
+    return restored
+
+
+def load_backup(db, filename, backup_directory, chunk_size=1000):
+    """Clear database and recreate from a backup in any format.
+
+    A delta backup is restored from its full backup plus its changes.
+
+    Everything happens in one transaction, rows are inserted in chunks.
+    Returns the number of restored rows and the seconds it took.
+    """
+    db.commit()
+    started = time.perf_counter()
 
-def remove_old_backups(backup_directory):
-    """Remove old backups.
+    filename = path.join(backup_directory, filename)
+    restored_format = backup_format(filename)
+    if restored_format == 'snapshot':
+        raise ValueError('snapshots are restored with restore_snapshot')
+    try:
+        # not in backups, its expense ids would point to restored rows,
+        # resolve_pending queues the expenses without in_eur again
+        db.execute(PendingConversion.__table__.delete())
+        clear_backup_tables(db)
+        delta = None
+        if restored_format == 'delta':
+            # restore the full backup first, then replay the changes
+            delta = filename
+            filename = path.join(backup_directory, delta_base(delta))
+        if backup_format(filename) == 'compact':
+            restored = _load_compact(db, filename, chunk_size)
+        else:
+            restored = _load_json(db, filename, chunk_size)
+        if delta is not None:
+            restored += _apply_delta(db, delta, chunk_size)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        invalidate_reference_data(db)
+    seconds = time.perf_counter() - started
+    instrumentation.add('backup: restore ' + restored_format, seconds,
+                        restored)
+    return restored, seconds
+
+
+def retention_plan(backups, now):
+    """File names of backups to remove, from manifest entries.
 
     Keep 5 newest backups of the day,
     newest backup of every day this month,
     newest backup of every month.
+    Deltas are kept the same way, but not in past months where a full
+    backup was written after them. A kept delta keeps its full backup,
+    deltas without their full backup are removed.
     """
-    # read backup directory, only backups should be here
-    backup_list = listdir(backup_directory)
-    today = []
-    this_month = []
-    monthly = []
-    for filename in backup_list:
-        if not filename.endswith('.expense'):
-            # not a backup
-            continue
+    newest_first = sorted(
+        ((datetime.strptime(entry['timestamp'], backup_timestring), name,
+          entry) for name, entry in backups.items()), reverse=True)
+    kept = {}
+    full_seen = set()
+    to_remove = set()
+    for time, name, entry in newest_first:
+        is_delta = entry['format'] == 'delta'
+        if time.date() == now.date():
+            bucket, limit = ('today', is_delta), 5
+        elif time.year == now.year and time.month == now.month:
+            bucket, limit = (time.date(), is_delta), 1
+        else:
+            month = (time.year, time.month)
+            bucket, limit = (month, is_delta), 1
+            if not is_delta:
+                full_seen.add(month)
+            elif month in full_seen:
+                # the newer full backup holds all of it
+                limit = 0
+        kept[bucket] = kept.get(bucket, 0) + 1
+        if kept[bucket] > limit:
+            to_remove.add(name)
+
+    for name, entry in backups.items():
+        if entry['format'] == 'delta' and name not in to_remove:
+            to_remove.discard(entry['base'])
+    for name, entry in backups.items():
+        if entry['format'] == 'delta' and (entry['base'] in to_remove or
+                                           entry['base'] not in backups):
+            to_remove.add(name)
+    return sorted(to_remove)
 
-        now = datetime.now()
-        try:
-            time = datetime.strptime(filename, backup_filename)
-            if time.date() == now.date():
-                today.append(time)
-            elif time.year == now.year and time.month == now.month:
-                this_month.append(time)
-            else:
-                monthly.append(time)
-        except ValueError:
-            print("Could not delete this old backup, did not understand"
-                  " the nameing format: %s" % filename)
-
-    # keep maximum 5 per day
-    today.sort(reverse=True)
-    to_remove = today[5:]
-
-    # keep maximum of 1 per day for the rest of the month
-    duplicates = []
-    for time in this_month:
-        same_date = [backup for backup in this_month
-                     if backup.date() == time.date()]
-        same_date.sort(reverse=True)
-        duplicates.extend(same_date[1:])
-    to_remove.extend(set(duplicates))
-
-    # for the rest, keep 1 per month
-    duplicates = []
-    for time in monthly:
-        same_date = [backup for backup in this_month
-                     if backup.month == time.month]
-        same_date.sort(reverse=True)
-        duplicates.extend(same_date[1:])
-    to_remove.extend(set(duplicates))
-
-    # now remove all files
-    for time in to_remove:
-        remove(path.join(backup_directory, time.strftime(backup_filename)))
+
+def remove_old_backups(backup_directory):
+    """Remove old backups as planned by retention_plan from the manifest."""
+    backups = load_manifest(backup_directory)
+    to_remove = retention_plan(backups, datetime.now())
+    for name in to_remove:
+        full_path = path.join(backup_directory, name)
+        if path.exists(full_path):
+            remove(full_path)
+        del backups[name]
+    if to_remove:
+        _write_json(path.join(backup_directory, manifest_filename),
+                    {'backups': backups})
 
 
 def write_config(config):
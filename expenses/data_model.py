@@ -1,10 +1,14 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Unicode
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Unicode,\
+    Date, Float, UniqueConstraint, Index, and_
 from sqlalchemy.orm import relationship
 
 
 Base = declarative_base()
 
+expense_format = '{time}: {price:>8} {currency.symbol}, {category.name}'\
+    '  |  {note}'
+
 
 class Expense(Base):
     __tablename__ = 'expenses'
@@ -24,9 +28,9 @@ class Expense(Base):
     def __str__(self):
         date_string = self.issued.strftime("%Y-%m-%d %H:%M")
         price_str = "{:.2f}".format(self.price / 100.0)
-        return ('{time}: {price:>8} {s.currency.symbol}, {s.category.name}'
-                '  |  {s.note}').format(
-                    time=date_string, price=price_str, s=self)
+        return expense_format.format(
+            time=date_string, price=price_str, currency=self.currency,
+            category=self.category, note=self.note)
 
     def _to_dict(self):
         return {'id': self.id,
@@ -35,6 +39,22 @@ class Expense(Base):
                 }
 
 
+# one partial index per query in statistics(), the simple expenses one
+# covers everything the query reads
+Index('ix_expenses_simple', Expense.issued, Expense.category_id,
+      Expense.in_eur,
+      sqlite_where=and_(Expense.end.is_(None),
+                        Expense.repeat_interval.is_(None)))
+Index('ix_expenses_long_term', Expense.end, Expense.issued,
+      sqlite_where=and_(Expense.end.isnot(None),
+                        Expense.repeat_interval.is_(None)))
+Index('ix_expenses_repeating', Expense.repeat_interval,
+      sqlite_where=Expense.repeat_interval.isnot(None))
+Index('ix_expenses_category', Expense.category_id)
+# keyset pagination of the history
+Index('ix_expenses_issued_id', Expense.issued, Expense.id)
+
+
 class Currency(Base):
     __tablename__ = 'currencies'
 
@@ -49,3 +69,36 @@ class Category(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(30))
+
+
+class PendingConversion(Base):
+    """Expense stored without in_eur as no rate was available yet."""
+    __tablename__ = 'pending_conversions'
+
+    id = Column(Integer, primary_key=True)
+    expense_id = Column(Integer, ForeignKey('expenses.id'), unique=True)
+    expense = relationship('Expense')
+    attempts = Column(Integer, default=0)
+    last_error = Column(String(100))
+
+
+class Rate(Base):
+    __tablename__ = 'rates'
+    __table_args__ = (UniqueConstraint('day', 'identifier'),)
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date)
+    identifier = Column(String(3))
+    # 1 EUR = rate * currency
+    rate = Column(Float)
+
+
+class MonthlyTotal(Base):
+    """Sum of all non repeating expenses of a category in a month."""
+    __tablename__ = 'monthly_totals'
+
+    # year * 12 + month
+    month = Column(Integer, primary_key=True)
+    category_id = Column(Integer, ForeignKey('categories.id'),
+                         primary_key=True)
+    amount = Column(Integer)
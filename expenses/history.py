@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Listing of tracked expenses."""
+
+from expenses.data_model import Expense
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+import datetime as dt
+
+
+def expense_history(db, year=None, month=None, category_id=None,
+                    currency_id=None, page_size=50):
+    """Yield pages of expenses in the order they were issued.
+
+    Currency and category are loaded in the same query, so printing an
+    expense needs no further queries. Pages continue after the (issued, id)
+    of the last row instead of using an offset.
+    """
+    query = db.query(Expense).options(joinedload(Expense.currency),
+                                      joinedload(Expense.category))
+    if year is not None and month is not None:
+        start = dt.datetime(year, month, 1)
+        end = dt.datetime(year + month // 12, month % 12 + 1, 1)
+        query = query.filter(Expense.issued >= start, Expense.issued < end)
+    if category_id is not None:
+        query = query.filter(Expense.category_id == category_id)
+    if currency_id is not None:
+        query = query.filter(Expense.currency_id == currency_id)
+    query = query.order_by(Expense.issued, Expense.id)
+
+    last = None
+    while True:
+        page = query
+        if last is not None:
+            page = page.filter(or_(
+                Expense.issued > last.issued,
+                and_(Expense.issued == last.issued, Expense.id > last.id)))
+        page = page.limit(page_size).all()
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last = page[-1]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""statistics() over the databases of several people, run in parallel.
+
+Every member is a dict like the config of a single database: a name, the
+db file, its password or raw_key and optionally pragmas and cipher. Their
+category ids differ, so results are merged by category name.
+"""
+
+from expenses.data_connector import db_connect, drop_engine
+from expenses.currencies import statistics
+from expenses.reference_data import category_names
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from sqlalchemy.exc import DatabaseError
+
+
+def member_statistics(member, year, month):
+    """statistics() of one member by category name, as plain data.
+
+    Returns a dict with the member name, the amounts per category name,
+    the not converted amounts per currency and an error message if the
+    database could not be read.
+    """
+    result = {'name': member.get('name', member['db']), 'categories': {},
+              'pending': {}, 'error': None}
+    password = member.get('raw_key', member.get('password'))
+    db = db_connect(member['db'], password=password,
+                    pragmas=member.get('pragmas'),
+                    cipher=member.get('cipher'))
+    try:
+        categories, _, pending = statistics(db, year, month,
+                                            with_pending=True)
+        names = category_names(db)
+        for category_id, amount in categories.items():
+            name = names[category_id]
+            result['categories'][name] = \
+                result['categories'].get(name, 0) + amount
+        result['pending'] = pending
+    except DatabaseError as e:
+        # wrong key or not a database, the others are still reported
+        result['error'] = str(e.orig)
+    finally:
+        db.close()
+        # sqlite connections have to be closed on the thread that made them
+        drop_engine(member['db'], password)
+    return result
+
+
+def merge_statistics(results):
+    """Sum up member results, (amount per category, pending per currency)."""
+    categories = {}
+    pending = {}
+    for result in results:
+        for name, amount in result['categories'].items():
+            categories[name] = categories.get(name, 0) + amount
+        for identifier, amount in result['pending'].items():
+            pending[identifier] = pending.get(identifier, 0) + amount
+    return categories, pending
+
+
+def household_statistics(members, year, month, max_workers=None,
+                         processes=False):
+    """statistics() of every member on a pool, and their merged totals.
+
+    Threads work in parallel as long as sqlite does the work, it releases
+    the GIL, which includes the key derivation of encrypted databases.
+    With processes the python part runs in parallel too. Returns the
+    member results in the order of members and merge_statistics() of them.
+    """
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool_class(max_workers=max_workers or len(members) or 1) as pool:
+        results = list(pool.map(member_statistics, members,
+                                [year] * len(members),
+                                [month] * len(members)))
+    return results, merge_statistics(results)
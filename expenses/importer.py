@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Import of bank statements exported as csv.
+
+Which columns hold what, the number format and the rules assigning
+categories are settings, see default_settings. Rows are read as a stream
+and written in chunks, each chunk with one batch currency conversion, one
+executemany and one commit together with the stored totals. Rows without
+an available rate are stored pending, like in expenses.pending.
+"""
+
+from expenses.data_model import Expense
+from expenses.data_connector import insert_rows
+from expenses.currencies import to_eur_many, known_rate
+from expenses.pending import defer_conversion
+from expenses.aggregates import rows_added
+from expenses.reference_data import currencies, categories
+from decimal import Decimal, InvalidOperation
+import csv
+import datetime as dt
+import re
+import time
+
+
+default_settings = {
+    # csv column of every field, the note may be a list of columns
+    'columns': {'issued': 'Buchungstag',
+                'amount': 'Betrag',
+                'currency': 'Waehrung',
+                'note': 'Verwendungszweck'},
+    'date_format': '%d.%m.%Y',
+    'delimiter': ';',
+    'decimal_comma': True,
+    'encoding': 'utf-8',
+    # lines before the header row
+    'skip_lines': 0,
+    # expenses are negative amounts, incoming money is skipped
+    'expenses_negative': True,
+    # [regular expression, category name], the first one found in the note
+    # decides
+    'rules': [],
+    'default_category': 'Sonstiges',
+    'default_currency': 'EUR',
+}
+
+
+class StatementError(ValueError):
+    pass
+
+
+def import_settings(settings=None):
+    """default_settings updated with the given ones."""
+    merged = dict(default_settings)
+    merged.update(settings or {})
+    return merged
+
+
+def parse_amount(text, decimal_comma=True):
+    """Amount in cents of a number like 1.234,56 or 1,234.56."""
+    text = text.strip().replace(' ', '')
+    if decimal_comma:
+        text = text.replace('.', '').replace(',', '.')
+    else:
+        text = text.replace(',', '')
+    try:
+        return int((Decimal(text) * 100).to_integral_value())
+    except InvalidOperation:
+        raise StatementError("'{}' is not an amount".format(text))
+
+
+def category_rules(db, settings):
+    """Compiled (pattern, category id) rules and the default category id."""
+    ids = {x.name: x.id for x in categories(db)}
+
+    def category_id(name):
+        if name not in ids:
+            raise StatementError('unknown category {}'.format(name))
+        return ids[name]
+
+    rules = [(re.compile(pattern, re.IGNORECASE), category_id(name))
+             for pattern, name in settings['rules']]
+    return rules, category_id(settings['default_category'])
+
+
+def read_statement(f, settings):
+    """Yield the expenses of a statement as dicts.
+
+    Each dict has the issue date, the price in cents, the currency
+    identifier and the full text of the note.
+    """
+    for _ in range(settings['skip_lines']):
+        next(f)
+    columns = settings['columns']
+    note_columns = columns.get('note', [])
+    if isinstance(note_columns, str):
+        note_columns = [note_columns]
+    sign = -1 if settings['expenses_negative'] else 1
+
+    reader = csv.DictReader(f, delimiter=settings['delimiter'])
+    for row in reader:
+        try:
+            price = sign * parse_amount(row[columns['amount']],
+                                        settings['decimal_comma'])
+            issued = dt.datetime.strptime(row[columns['issued']].strip(),
+                                          settings['date_format'])
+        except KeyError as e:
+            raise StatementError('column {} is missing'.format(e.args[0]))
+        except ValueError as e:
+            raise StatementError('line {}: {}'.format(
+                reader.line_num + settings['skip_lines'], e))
+        if price <= 0:
+            continue
+        identifier = None
+        if 'currency' in columns:
+            identifier = row.get(columns['currency'], '').strip().upper()
+        yield {'issued': issued,
+               'price': price,
+               'identifier': identifier or settings['default_currency'],
+               'note': ' '.join(row.get(column, '').strip()
+                                for column in note_columns).strip()}
+
+
+def import_rows(db, rows, settings, chunk_size=1000):
+    """Insert expenses as given by read_statement, returns their number."""
+    currency_ids = {x.identifier: x.id for x in currencies(db)}
+    rules, default_category = category_rules(db, settings)
+
+    def convert(chunk):
+        items = [(x['price'], x['identifier'], x['issued']) for x in chunk]
+        try:
+            return to_eur_many(items, db=db)
+        except (OSError, ValueError, KeyError):
+            # requests errors are OSErrors, rows without a known rate are
+            # converted later by resolve_pending
+            in_eur = []
+            for price, identifier, issued in items:
+                rate = 1.0 if identifier == 'EUR' else \
+                    known_rate(identifier, issued, db)
+                in_eur.append(None if rate is None else round(price / rate))
+            return in_eur
+
+    def insert(chunk):
+        in_eur = convert(chunk)
+        expenses = []
+        for item, eur in zip(chunk, in_eur):
+            category_id = next((category for pattern, category in rules
+                                if pattern.search(item['note'])),
+                               default_category)
+            expenses.append({'issued': item['issued'],
+                             'end': None,
+                             'repeat_interval': None,
+                             'price': item['price'],
+                             'in_eur': eur,
+                             'note': item['note'][:50] or None,
+                             'currency_id': currency_ids[item['identifier']],
+                             'category_id': category_id})
+        converted = [x for x in expenses if x['in_eur'] is not None]
+        insert_rows(db, Expense, converted)
+        rows_added(db, converted)
+        for row in expenses:
+            if row['in_eur'] is None:
+                defer_conversion(db, Expense(**row))
+        db.commit()
+
+    imported = 0
+    chunk = []
+    try:
+        for item in rows:
+            if item['identifier'] not in currency_ids:
+                raise StatementError('unknown currency {}'.format(
+                    item['identifier']))
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                insert(chunk)
+                imported += len(chunk)
+                chunk = []
+        if chunk:
+            insert(chunk)
+            imported += len(chunk)
+    except BaseException:
+        # chunks committed before stay imported
+        db.rollback()
+        raise
+    return imported
+
+
+def import_csv(db, filename, settings=None, chunk_size=1000):
+    """Import a bank statement, returns the imported rows and seconds.
+
+    Every chunk is committed on its own, after an error the rows of the
+    chunks before stay imported.
+    """
+    settings = import_settings(settings)
+    started = time.perf_counter()
+    with open(filename, 'r', encoding=settings['encoding'],
+              newline='') as f:
+        imported = import_rows(db, read_statement(f, settings), settings,
+                               chunk_size)
+    return imported, time.perf_counter() - started
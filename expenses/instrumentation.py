@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Opt-in timings of sql statements, rate lookups, reports and backups.
+
+Nothing is recorded until enable() is called, the hooks then cost a
+function call and a check. Every timed event has a name like
+'sql: SELECT ...', 'fx: fetch' or 'statistics: long term' and optionally
+a number of items, like the rows of a backup, to show a throughput.
+"""
+
+from sqlalchemy import event
+import json
+import time
+
+
+enabled = False
+_started = None
+# (name, start offset, seconds, items)
+_events = []
+
+
+def enable():
+    global enabled, _started
+    enabled = True
+    if _started is None:
+        _started = time.perf_counter()
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    global _started
+    del _events[:]
+    _started = time.perf_counter() if enabled else None
+
+
+def add(name, seconds, items=None):
+    """Record an event that took seconds and ended now."""
+    if enabled:
+        now = time.perf_counter()
+        _events.append((name, now - seconds - _started, seconds, items))
+
+
+def count(name, items=1):
+    """Record an event without duration, like a cache hit."""
+    if enabled:
+        _events.append((name, time.perf_counter() - _started, 0.0, items))
+
+
+class _Timer():
+
+    def __init__(self, name):
+        self.name = name
+        self.items = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        add(self.name, time.perf_counter() - self.started, self.items)
+
+
+class _NoTimer():
+    items = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def timer(name):
+    """Context manager recording the time of its block.
+
+    Set items on the returned object to record a throughput.
+    """
+    if enabled:
+        return _Timer(name)
+    return _NoTimer()
+
+
+def _before_execute(conn, cursor, statement, parameters, context,
+                    executemany):
+    conn.info.setdefault('instrumentation', []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context,
+                   executemany):
+    started = conn.info['instrumentation'].pop()
+    items = len(parameters) if executemany else None
+    add('sql: ' + ' '.join(statement.split()),
+        time.perf_counter() - started, items)
+
+
+def instrument_engine(engine):
+    """Time every statement run by an engine, once per engine."""
+    if not event.contains(engine, 'before_cursor_execute', _before_execute):
+        event.listen(engine, 'before_cursor_execute', _before_execute)
+        event.listen(engine, 'after_cursor_execute', _after_execute)
+
+
+def summary():
+    """Per name the calls, total and max seconds and items, slowest first."""
+    totals = {}
+    for name, _, seconds, items in _events:
+        total = totals.setdefault(name, [0, 0.0, 0.0, None])
+        total[0] += 1
+        total[1] += seconds
+        total[2] = max(total[2], seconds)
+        if items is not None:
+            total[3] = (total[3] or 0) + items
+    return sorted(((name,) + tuple(total) for name, total in totals.items()),
+                  key=lambda x: -x[2])
+
+
+def print_summary(limit=25, width=60):
+    print('\n{:<{width}} {:>6} {:>10} {:>9} {:>10}'.format(
+        'event', 'calls', 'total ms', 'max ms', 'items/s', width=width))
+    for name, calls, seconds, longest, items in summary()[:limit]:
+        if len(name) > width:
+            name = name[:width - 3] + '...'
+        rate = '' if items is None or seconds == 0 else \
+            '{:.0f}'.format(items / seconds)
+        print('{:<{width}} {:>6} {:>10.1f} {:>9.1f} {:>10}'.format(
+            name, calls, seconds * 1000, longest * 1000, rate, width=width))
+
+
+def write_trace(filename):
+    """Write the summary and every single event as JSON."""
+    with open(filename, 'w') as f:
+        json.dump({'summary': [
+            {'name': name, 'calls': calls, 'seconds': seconds,
+             'max_seconds': longest, 'items': items}
+            for name, calls, seconds, longest, items in summary()],
+            'events': [
+                {'name': name, 'start': start, 'seconds': seconds,
+                 'items': items}
+                for name, start, seconds, items in _events]}, f, indent=1)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Expenses stored before their conversion to EUR.
+
+An expense whose rate is not known yet is stored with in_eur None and a
+PendingConversion entry, so entering expenses never waits for the rate
+api. resolve_pending() converts them later in one batch. Expenses without
+in_eur count as pending even without their entry, like after restoring a
+backup, which does not hold the queue.
+"""
+
+from expenses.data_model import Expense, Currency, PendingConversion
+from expenses.currencies import known_rate, store_rate, fetch_rates,\
+    to_eur_many, _as_day
+from expenses.aggregates import expense_added
+from concurrent.futures import ThreadPoolExecutor
+
+
+def defer_conversion(db, expense):
+    """Store an expense without in_eur and queue its conversion."""
+    expense.in_eur = None
+    db.add(expense)
+    db.add(PendingConversion(expense=expense, attempts=0))
+
+
+def pending_count(db):
+    return db.query(Expense).filter(Expense.in_eur.is_(None)).count()
+
+
+def _convert(db, item, eur, entry):
+    item.in_eur = eur
+    # was left out of the stored totals so far
+    expense_added(db, item)
+    if entry is not None:
+        db.delete(entry)
+
+
+def resolve_pending(db, fetch=True, max_workers=4):
+    """Convert the pending expenses whose rate is available.
+
+    Without fetch only rates known without the api are used. All missing
+    rates are first fetched in one batch. If a rate is missing the others
+    are fetched on their own, if the api is not reachable at all nothing
+    more is fetched. Failures are kept in the queue. Returns the
+    number of converted and of still pending expenses.
+    """
+    rows = db.query(Expense, Currency.identifier)\
+        .join(Currency, Expense.currency_id == Currency.id)\
+        .filter(Expense.in_eur.is_(None)).order_by(Expense.id).all()
+    if not rows:
+        return 0, 0
+    entries = {x.expense_id: x for x in db.query(PendingConversion)}
+
+    converted = {}
+    error = None
+    if fetch:
+        try:
+            values = to_eur_many(
+                ((item.price, identifier, item.issued)
+                 for item, identifier in rows), db=db,
+                max_workers=max_workers)
+            converted = {item.id: eur
+                         for (item, _), eur in zip(rows, values)}
+        except OSError as e:
+            # requests errors are OSErrors, the api is not reachable
+            fetch = False
+            error = str(e)
+        except (ValueError, KeyError):
+            # some rate is missing, the others are fetched one by one
+            pass
+
+    failed = {}
+    still_pending = 0
+    for item, identifier in rows:
+        entry = entries.get(item.id)
+        if item.id not in converted:
+            day = _as_day(item.issued)
+            rate = 1.0 if identifier == 'EUR' else \
+                known_rate(identifier, day, db)
+            if rate is None and fetch and (day, identifier) not in failed:
+                try:
+                    rate = fetch_rates(day, [identifier])[identifier]
+                    store_rate(identifier, day, rate, db)
+                except OSError as e:
+                    # the api is not reachable, no use asking again
+                    fetch = False
+                    error = str(e)
+                except (ValueError, KeyError) as e:
+                    failed[(day, identifier)] = 'no rate: {}'.format(e)
+            if rate is None:
+                still_pending += 1
+                if entry is None:
+                    entry = PendingConversion(expense_id=item.id,
+                                              attempts=0)
+                    db.add(entry)
+                last_error = failed.get((day, identifier), error)
+                if last_error is not None:
+                    entry.attempts = (entry.attempts or 0) + 1
+                    entry.last_error = last_error[:100]
+                continue
+            converted[item.id] = round(item.price / rate)
+        _convert(db, item, converted[item.id], entry)
+    db.commit()
+    return len(rows) - still_pending, still_pending
+
+
+class BackgroundRates():
+    """Fetch rates on worker threads while the user keeps typing.
+
+    The workers only talk to the api. The rates are stored from the
+    thread owning the session, in collect().
+    """
+
+    def __init__(self, max_workers=2):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.requested = {}
+
+    def request(self, identifier, date, db=None):
+        """Start fetching a rate unless it is known or on its way."""
+        day = _as_day(date)
+        key = (day, identifier)
+        if identifier == 'EUR' or key in self.requested or \
+                known_rate(identifier, day, db) is not None:
+            return
+        self.requested[key] = self.pool.submit(fetch_rates, day,
+                                               [identifier])
+
+    def collect(self, db, wait=False):
+        """Store the rates fetched so far, failed fetches are dropped."""
+        for (day, identifier), future in list(self.requested.items()):
+            if not wait and not future.done():
+                continue
+            del self.requested[(day, identifier)]
+            try:
+                rate = future.result()[identifier]
+            except (OSError, ValueError, KeyError):
+                continue
+            store_rate(identifier, day, rate, db)
+
+    def close(self, db):
+        """Wait for the running fetches and store their rates."""
+        self.collect(db, wait=True)
+        self.pool.shutdown()
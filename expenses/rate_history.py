@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Offline table of historical reference rates."""
+
+from array import array
+from bisect import bisect_right
+import csv
+import datetime as dt
+
+
+class RateHistory():
+    """Reference rates per currency, kept as sorted arrays of day ordinals.
+
+    Days without a rate (weekends, holidays) are answered with the rate of
+    the last business day before, as long as it is at most max_gap days old.
+    """
+
+    def __init__(self, max_gap=7):
+        self.max_gap = max_gap
+        self._days = {}
+        self._rates = {}
+
+    def __len__(self):
+        return sum(len(days) for days in self._days.values())
+
+    def __contains__(self, identifier):
+        return identifier in self._days
+
+    def add_series(self, identifier, series):
+        """Add (date, rate) pairs of one currency, in any order."""
+        series = sorted(series)
+        self._days[identifier] = array('l', (day.toordinal()
+                                             for day, _ in series))
+        self._rates[identifier] = array('d', (rate for _, rate in series))
+
+    def lookup(self, identifier, date):
+        """Rate at date (1 EUR = rate * currency) or None if unknown."""
+        days = self._days.get(identifier)
+        if days is None:
+            return None
+        day = date.toordinal()
+        index = bisect_right(days, day) - 1
+        if index < 0 or day - days[index] > self.max_gap:
+            return None
+        return self._rates[identifier][index]
+
+
+def load_ecb_csv(filename, max_gap=7):
+    """Read the ECB reference rate history (eurofxref-hist.csv)."""
+    series = {}
+    with open(filename, 'r', newline='') as f:
+        reader = csv.reader(f)
+        identifiers = [x.strip() for x in next(reader)[1:]]
+        for row in reader:
+            if not row:
+                continue
+            day = dt.datetime.strptime(row[0].strip(), '%Y-%m-%d').date()
+            for identifier, value in zip(identifiers, row[1:]):
+                value = value.strip()
+                if not identifier or value in ('', 'N/A'):
+                    continue
+                series.setdefault(identifier, []).append((day, float(value)))
+
+    history = RateHistory(max_gap=max_gap)
+    for identifier, values in series.items():
+        history.add_series(identifier, values)
+    return history
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Currencies and categories, read once per session.
+
+Both tables are small and change rarely, so they are kept as plain rows in
+db.info. The rows do not expire on commit like mapped objects do, so
+reading them never runs a query. Whatever changes either table has to call
+invalidate_reference_data().
+"""
+
+from expenses.data_model import Currency, Category, expense_format
+from collections import namedtuple
+
+
+CurrencyRow = namedtuple('CurrencyRow', ['id', 'name', 'identifier',
+                                         'symbol'])
+CategoryRow = namedtuple('CategoryRow', ['id', 'name'])
+
+
+def reference_data(db):
+    """Cached currency and category rows of a session, ordered by id."""
+    cached = db.info.get('reference_data')
+    if cached is None:
+        currencies = [CurrencyRow(*x) for x in db.query(
+            Currency.id, Currency.name, Currency.identifier,
+            Currency.symbol).order_by(Currency.id)]
+        categories = [CategoryRow(*x) for x in db.query(
+            Category.id, Category.name).order_by(Category.id)]
+        cached = {'currencies': currencies,
+                  'categories': categories,
+                  'currency': {x.id: x for x in currencies},
+                  'category': {x.id: x for x in categories}}
+        db.info['reference_data'] = cached
+    return cached
+
+
+def invalidate_reference_data(db):
+    """Read both tables again on the next access."""
+    db.info.pop('reference_data', None)
+
+
+def currencies(db):
+    return reference_data(db)['currencies']
+
+
+def categories(db):
+    return reference_data(db)['categories']
+
+
+def category_ids(db):
+    return [x.id for x in categories(db)]
+
+
+def category_names(db):
+    return {x.id: x.name for x in categories(db)}
+
+
+def describe_expense(db, item):
+    """Same as str(item), without loading currency and category."""
+    cached = reference_data(db)
+    return expense_format.format(
+        time=item.issued.strftime("%Y-%m-%d %H:%M"),
+        price="{:.2f}".format(item.price / 100.0),
+        currency=cached['currency'][item.currency_id],
+        category=cached['category'][item.category_id],
+        note=item.note)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Statistics over several months at once."""
+
+from collections import namedtuple
+from expenses.data_model import Expense
+from expenses.reference_data import category_ids as _category_ids
+from expenses.currencies import month_bounds, long_term_expenses,\
+    repeating_expenses, fractional_expense, repeating_expense
+from sqlalchemy import func, case, and_
+import numpy as np
+
+
+# amounts[i, j] is the amount in cents of category_ids[j] in months[i],
+# repeaters[i] the repeating expenses counting into months[i]
+MonthlyStatistics = namedtuple('MonthlyStatistics',
+                               ['months', 'category_ids', 'amounts',
+                                'repeaters'])
+
+
+def month_range(start, end):
+    """All (year, month) pairs from the month of start to the one of end."""
+    first = start.year * 12 + start.month - 1
+    last = end.year * 12 + end.month - 1
+    return [(x // 12, x % 12 + 1) for x in range(first, last + 1)]
+
+
+def simple_totals_range(db, bounds):
+    """Sums of simple expenses as (month index, category_id, sum) rows.
+
+    One query for all months, each expense counts into the month whose
+    bounds hold it, like in simple_totals.
+    """
+    month = case(*[(and_(Expense.issued >= start_of_month,
+                         Expense.issued <= end_of_month), i)
+                   for i, (start_of_month, end_of_month) in enumerate(bounds)],
+                 else_=None)
+    return db.query(month, Expense.category_id, func.sum(Expense.in_eur))\
+        .filter(Expense.end.is_(None), Expense.repeat_interval.is_(None),
+                Expense.issued >= bounds[0][0],
+                Expense.issued <= bounds[-1][1])\
+        .group_by(month, Expense.category_id)
+
+
+def statistics_range(db, start, end):
+    """Same as statistics() for every month from start to end.
+
+    Long term and repeating expenses are read once for the whole range and
+    spread over all months they count into.
+    """
+    months = month_range(start, end)
+    if not months:
+        raise ValueError('end lays before start')
+    category_ids = _category_ids(db)
+    column = {category_id: j for j, category_id in enumerate(category_ids)}
+    amounts = np.zeros((len(months), len(category_ids)), dtype=np.int64)
+    repeaters = [[] for _ in months]
+
+    bounds = [month_bounds(year, month) for year, month in months]
+    first_month = months[0][0] * 12 + months[0][1]
+
+    # simple expenses are disjoint per month, sqlite sums them up
+    for i, category_id, amount in simple_totals_range(db, bounds):
+        if i is not None:
+            amounts[i, column[category_id]] += amount or 0
+
+    # long term expenses, only the months they overlap
+    for item in long_term_expenses(db, bounds[0][0], bounds[-1][1]):
+        first = max(item.issued.year * 12 + item.issued.month - first_month,
+                    0)
+        last = min(item.end.year * 12 + item.end.month - first_month,
+                   len(months) - 1)
+        for i in range(first, last + 1):
+            start_of_month, end_of_month = bounds[i]
+            if item.issued <= end_of_month and item.end >= start_of_month:
+                amounts[i, column[item.category_id]] += \
+                    fractional_expense(item, end_of_month, False)
+
+    # repeating expenses
+    for item in repeating_expenses(db):
+        for i, (_, end_of_month) in enumerate(bounds):
+            amount = repeating_expense(item, end_of_month)
+            if amount > 0:
+                amounts[i, column[item.category_id]] += amount
+                repeaters[i].append(item)
+
+    return MonthlyStatistics(months, category_ids, amounts, repeaters)
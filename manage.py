@@ -1,5 +1,7 @@
-from expenses.data_connector import db_create, write_config
-from command_line.user_input import str_input, bool_question
+from expenses.data_connector import db_create, write_config,\
+    recommended_pragmas, default_kdf_iter, default_cipher_page_size,\
+    derive_raw_key, raw_key_string
+from command_line.user_input import str_input, bool_question, type_input
 
 
 if __name__ == '__main__':
@@ -12,13 +14,36 @@ if __name__ == '__main__':
         print('Password too short, min. 6 characters')
         db_password = str_input('database password', default='123456')
 
-    db_create(db_name, password=db_password)
+    cipher = {}
+    if bool_question('change encryption settings?', default=False):
+        # fewer iterations unlock faster, but make guessing cheaper
+        kdf_iter = type_input('key derivation iterations', int,
+                              default=default_kdf_iter)
+        page_size = type_input('cipher page size', int,
+                               default=default_cipher_page_size)
+        if kdf_iter != default_kdf_iter:
+            cipher['kdf_iter'] = kdf_iter
+        if page_size != default_cipher_page_size:
+            cipher['cipher_page_size'] = page_size
+
+    db_create(db_name, password=db_password, cipher=cipher)
 
     config = {}
+    if cipher:
+        config['cipher'] = cipher
     if bool_question('store login in config?', default=True):
         config['db'] = db_name
-        config['password'] = db_password
+        if bool_question('store derived key instead of password?',
+                         default=False):
+            config['raw_key'] = raw_key_string(derive_raw_key(
+                db_name, db_password,
+                cipher.get('kdf_iter', default_kdf_iter)))
+        else:
+            config['password'] = db_password
 
     config['backup_dir'] = str_input('backup directory', default='backup')
 
+    if bool_question('use recommended sqlite settings (WAL)?', default=True):
+        config['pragmas'] = recommended_pragmas
+
     write_config(config)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Run from the repository root: python -m pytest"""
+
+from expenses.data_connector import db_create, db_connect, drop_engine,\
+    write_backup, write_incremental_backup, load_backup, backup_format,\
+    backup_tables, table_rows, load_manifest
+from expenses.data_model import Expense, Category
+from os import path
+import datetime as dt
+import pytest
+
+
+@pytest.fixture
+def db(tmp_path):
+    name = str(tmp_path / 'expenses.db')
+    db_create(name)
+    db = db_connect(name)
+    category_id = db.query(Category).first().id
+    for i in range(20):
+        issued = dt.datetime(2020, 1, 1, 12, 30) + dt.timedelta(days=i)
+        db.add(Expense(issued=issued, price=100 * i + 1, in_eur=100 * i + 1,
+                       note='expense {}'.format(i) if i % 2 else None,
+                       end=issued + dt.timedelta(days=30) if i % 3 == 0
+                       else None,
+                       repeat_interval=2 if i % 5 == 0 else None,
+                       currency_id=1, category_id=category_id))
+    db.commit()
+    yield db
+    db.close()
+    drop_engine(name, None)
+
+
+def contents(db):
+    return {section: list(table_rows(db, model))
+            for section, model in backup_tables}
+
+
+@pytest.mark.parametrize('written_format', ['json', 'compact'])
+def test_backup_round_trip(db, tmp_path, written_format):
+    backup_directory = str(tmp_path / 'backup')
+    expected = contents(db)
+    filename = write_backup(db, backup_directory,
+                            backup_format=written_format)
+    assert backup_format(filename) == written_format
+
+    db.query(Expense).delete()
+    db.commit()
+    restored, _ = load_backup(db, path.basename(filename), backup_directory)
+
+    assert restored == sum(len(x) for x in expected.values())
+    assert contents(db) == expected
+
+
+def test_incremental_backup(db, tmp_path):
+    backup_directory = str(tmp_path / 'backup')
+    full = write_incremental_backup(db, backup_directory)
+    assert backup_format(full) == 'json'
+    # nothing changed, nothing written
+    assert write_incremental_backup(db, backup_directory) is None
+
+    expenses = db.query(Expense).order_by(Expense.id).all()
+    expenses[3].note = 'changed'
+    expenses[3].in_eur += 5
+    db.delete(expenses[7])
+    db.add(Expense(issued=dt.datetime(2020, 3, 1), price=999, in_eur=999,
+                   currency_id=1, category_id=expenses[0].category_id))
+    db.commit()
+    expected = contents(db)
+    delta = write_incremental_backup(db, backup_directory)
+    assert backup_format(delta) == 'delta'
+    assert load_manifest(backup_directory)[path.basename(delta)]['rows'] == \
+        {'Currencies': 0, 'Categories': 0, 'Expenses': 2, 'Deleted': 1}
+
+    db.query(Expense).delete()
+    db.commit()
+    load_backup(db, path.basename(delta), backup_directory)
+    assert contents(db) == expected
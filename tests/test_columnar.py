@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Run from the repository root: python -m pytest"""
+
+from expenses.columnar import ColumnarStatistics
+from expenses.currencies import statistics
+from expenses.data_connector import db_create, db_connect, drop_engine,\
+    insert_rows
+from expenses.data_model import Expense, Category
+from expenses.reference_data import invalidate_reference_data
+import datetime as dt
+import random
+import pytest
+
+
+def random_rows(rng, rows, category_ids):
+    """Plain, long term and repeating expenses of 2019 to 2021."""
+    for _ in range(rows):
+        issued = dt.datetime(2019, 1, 1) + dt.timedelta(
+            days=rng.randrange(3 * 365), minutes=rng.randrange(24 * 60))
+        end = None
+        repeat_interval = None
+        kind = rng.random()
+        if kind < 0.3:
+            end = issued + dt.timedelta(days=rng.randrange(0, 500))
+        elif kind < 0.55:
+            repeat_interval = rng.randrange(1, 13)
+            if rng.random() < 0.5:
+                end = issued + dt.timedelta(days=rng.randrange(0, 100))
+        if end is not None and rng.random() < 0.2:
+            # ends on the day it was issued
+            end = issued + dt.timedelta(
+                minutes=rng.randrange(24 * 60 - issued.hour * 60 -
+                                      issued.minute))
+        yield {'issued': issued,
+               'end': end,
+               'repeat_interval': repeat_interval,
+               'price': 0,
+               'in_eur': rng.randrange(1, 200000),
+               'note': None,
+               'currency_id': 1,
+               'category_id': rng.choice(category_ids)}
+
+
+@pytest.fixture
+def db(tmp_path):
+    name = str(tmp_path / 'expenses.db')
+    db_create(name)
+    db = db_connect(name)
+    db.add_all([Category(name=x) for x in ('Miete', 'Reisen', 'Essen')])
+    db.commit()
+    invalidate_reference_data(db)
+    category_ids = [x.id for x in db.query(Category)]
+    insert_rows(db, Expense,
+                list(random_rows(random.Random(9), 3000, category_ids)))
+    db.commit()
+    yield db
+    db.close()
+    drop_engine(name, None)
+
+
+def test_columnar_matches_statistics(db):
+    engine = ColumnarStatistics(db)
+    for month in range(2018 * 12 + 11, 2022 * 12 + 3):
+        year, month = month // 12, month % 12 + 1
+        categories, repeaters = engine.month(year, month)
+        expected_categories, expected_repeaters = statistics(db, year,
+                                                             month)
+        assert categories == expected_categories, (year, month)
+        assert sorted(x.id for x in repeaters) == \
+            sorted(x.id for x in expected_repeaters), (year, month)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Run from the repository root: python -m pytest"""
+
+from expenses.currencies import repeating_expense, amount_in_month,\
+    month_bounds
+from expenses.data_model import Expense
+import datetime as dt
+import random
+import pytest
+
+
+def loop_repeating_expense(item, end_of_month):
+    """repeating_expense as it was, walking every repetition."""
+    step = item.repeat_interval
+    affected_month = end_of_month.year * 12 + end_of_month.month
+    start_month = item.issued.year * 12 + item.issued.month
+    if item.end is not None:
+        end_month = item.end.year * 12 + item.end.month
+        end_date = item.end
+    else:
+        end_month = start_month
+        end_date = item.issued
+
+    amount = 0
+    while start_month <= affected_month:
+        amount += amount_in_month(start_month, item.issued, end_month,
+                                  end_date, end_of_month, item.in_eur)
+        start_month += step
+        end_month += step
+    return amount
+
+
+def outcome(function, item, end_of_month):
+    """Result of a repeating_expense version or the type it raised."""
+    # ending hours before the issue on the same day lasts zero days, both
+    # versions divide by it
+    try:
+        return function(item, end_of_month)
+    except ZeroDivisionError as e:
+        return type(e)
+
+
+def random_expense(rng):
+    issued = dt.datetime(2015, 1, 1) + dt.timedelta(
+        days=rng.randrange(3000), minutes=rng.randrange(24 * 60))
+    kind = rng.random()
+    if kind < 0.3:
+        end = None
+    elif kind < 0.4:
+        # ends before it was issued, maybe only hours before
+        end = issued - dt.timedelta(minutes=rng.randrange(1, 60 * 24 * 90))
+    elif kind < 0.5:
+        # ends on the day it was issued
+        end = issued.replace(hour=rng.randrange(24),
+                             minute=rng.randrange(60))
+    else:
+        end = issued + dt.timedelta(days=rng.randrange(1, 800),
+                                    minutes=rng.randrange(24 * 60))
+    return Expense(issued=issued, end=end, in_eur=rng.randrange(1, 100000),
+                   repeat_interval=rng.randrange(1, 25))
+
+
+def test_repeating_expense_matches_loop():
+    rng = random.Random(6)
+    for _ in range(20000):
+        item = random_expense(rng)
+        month = item.issued.year * 12 + item.issued.month - 1 + \
+            rng.randrange(-12, 120)
+        _, end_of_month = month_bounds(month // 12, month % 12 + 1)
+        assert outcome(repeating_expense, item, end_of_month) == \
+            outcome(loop_repeating_expense, item, end_of_month), \
+            (item.issued, item.end, item.repeat_interval, end_of_month)
+
+
+def test_repeating_expense_needs_interval():
+    item = Expense(issued=dt.datetime(2020, 1, 1), end=None, in_eur=100,
+                   repeat_interval=0)
+    with pytest.raises(ValueError):
+        repeating_expense(item, dt.datetime(2020, 2, 29))
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Run from the repository root: python -m pytest"""
+
+from expenses.data_connector import db_create, db_connect, drop_engine,\
+    check_password, write_snapshot, restore_snapshot, write_backup,\
+    load_backup, retention_plan, backup_filename, delta_filename,\
+    snapshot_filename, backup_timestring
+from expenses.data_model import Currency, Category, Expense,\
+    PendingConversion
+from expenses.pending import defer_conversion
+from os import path
+import datetime as dt
+import pytest
+
+
+def _pending_expense(db):
+    usd = db.query(Currency).filter_by(identifier='USD').one()
+    expense = Expense(issued=dt.datetime(2020, 1, 1), price=1000,
+                      currency_id=usd.id,
+                      category_id=db.query(Category).first().id)
+    defer_conversion(db, expense)
+    db.commit()
+    return expense
+
+
+def test_restore_clears_pending(tmp_path):
+    """Queue entries of replaced expenses do not block reused ids."""
+    name = str(tmp_path / 'expenses.db')
+    backup_directory = str(tmp_path / 'backup')
+    db_create(name)
+    db = db_connect(name)
+    try:
+        filename = write_backup(db, backup_directory)
+        _pending_expense(db)
+        load_backup(db, path.basename(filename), backup_directory)
+        assert db.query(PendingConversion).count() == 0
+        # gets the id of the expense replaced by the backup
+        _pending_expense(db)
+        assert db.query(PendingConversion).count() == 1
+    finally:
+        db.close()
+        drop_engine(name, None)
+
+
+def test_snapshot_keeps_password(tmp_path):
+    """A snapshot written with the raw key opens with the password."""
+    sqlcipher3 = pytest.importorskip('sqlcipher3')
+    name = str(tmp_path / 'expenses.db')
+    backup_directory = str(tmp_path / 'backup')
+    # few iterations, the test is about the salt
+    cipher = {'kdf_iter': 1000}
+    db_create(name, 'secret', cipher=cipher)
+    raw_key = check_password(name, 'secret', kdf_iter=1000)
+    assert raw_key is not None
+
+    db = db_connect(name, password=raw_key, cipher=cipher)
+    currencies = db.query(Currency).count()
+    filename = write_snapshot(db, backup_directory, password=raw_key,
+                              cipher=cipher)
+    db.close()
+    drop_engine(name, raw_key)
+    restore_snapshot(path.basename(filename), backup_directory, name)
+
+    assert check_password(name, 'secret', kdf_iter=1000) == raw_key
+    connection = sqlcipher3.connect(name)
+    try:
+        connection.execute("PRAGMA key='secret'")
+        connection.execute('PRAGMA kdf_iter=1000')
+        assert connection.execute('SELECT count(*) FROM currencies')\
+            .fetchone()[0] == currencies
+    finally:
+        connection.close()
+
+
+def _manifest(*backups):
+    """Manifest entries of (time, format, time of the base) backups."""
+    names = {'json': backup_filename, 'delta': delta_filename,
+             'snapshot': snapshot_filename}
+    manifest = {}
+    for time, backup_format, base in backups:
+        entry = {'timestamp': time.strftime(backup_timestring),
+                 'format': backup_format}
+        if base is not None:
+            entry['base'] = base.strftime(backup_filename)
+        manifest[time.strftime(names[backup_format])] = entry
+    return manifest
+
+
+def test_retention_plan():
+    now = dt.datetime(2026, 10, 18, 12, 0)
+    today = dt.datetime(2026, 10, 18, 8, 0)
+    today_deltas = [dt.datetime(2026, 10, 18, 9, minute)
+                    for minute in range(0, 60, 10)]
+    october_1 = dt.datetime(2026, 10, 1, 8, 0)
+    october_5 = [dt.datetime(2026, 10, 5, hour, 0) for hour in (10, 12)]
+    october_10 = [dt.datetime(2026, 10, 10, hour, 0) for hour in (9, 18)]
+    september_1 = dt.datetime(2026, 9, 1, 8, 0)
+    september = [dt.datetime(2026, 9, day, 20, 0) for day in (15, 30)]
+    august = [dt.datetime(2026, 8, day, 8, 0) for day in (1, 10, 20, 25)]
+    backups = _manifest(
+        (dt.datetime(2026, 10, 18, 7, 0), 'snapshot', None),
+        (today, 'json', None),
+        *[(time, 'delta', today) for time in today_deltas],
+        (october_1, 'json', None),
+        *[(time, 'delta', october_1) for time in october_5],
+        *[(time, 'json', None) for time in october_10],
+        # keeps its full backup, though not the newest of the day
+        (dt.datetime(2026, 10, 10, 20, 0), 'delta', october_10[0]),
+        (september_1, 'json', None),
+        *[(time, 'delta', september_1) for time in september],
+        (august[0], 'json', None),
+        (august[1], 'delta', august[0]),
+        (august[2], 'json', None),
+        (august[3], 'snapshot', None),
+        # its full backup is gone already
+        (dt.datetime(2026, 7, 20, 8, 0), 'delta',
+         dt.datetime(2026, 7, 1, 8, 0)))
+
+    assert retention_plan(backups, now) == sorted([
+        # the sixth delta of today
+        today_deltas[0].strftime(delta_filename),
+        # older ones of the same day
+        october_5[0].strftime(delta_filename),
+        # a past month keeps its newest delta and the delta's full backup
+        september[0].strftime(delta_filename),
+        # or its newest full backup, if written after the deltas
+        august[0].strftime(backup_filename),
+        august[1].strftime(delta_filename),
+        august[2].strftime(backup_filename),
+        dt.datetime(2026, 7, 20, 8, 0).strftime(delta_filename)])
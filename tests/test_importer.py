@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Run from the repository root: python -m pytest"""
+
+from expenses import currencies
+from expenses.data_connector import db_create, db_connect, drop_engine
+from expenses.data_model import Expense, PendingConversion
+from expenses.importer import import_csv
+import pytest
+
+
+statement = '''Buchungstag;Betrag;Waehrung;Verwendungszweck
+01.01.2020;-12,50;EUR;Baecker
+02.01.2020;-30,00;USD;Buchladen
+03.01.2020;-7,00;EUR;Kiosk
+'''
+
+
+@pytest.fixture
+def db(tmp_path):
+    name = str(tmp_path / 'expenses.db')
+    db_create(name)
+    db = db_connect(name)
+    yield db
+    db.close()
+    drop_engine(name, None)
+
+
+def test_import_without_api(db, tmp_path, monkeypatch):
+    """Rows without a rate are stored pending, the others converted."""
+    # nothing listens there, the api is not reachable
+    monkeypatch.setattr(currencies, 'rate_api',
+                        'http://127.0.0.1:9/{date}?symbols={symb}')
+    currencies.clear_rate_cache()
+    filename = tmp_path / 'statement.csv'
+    filename.write_text(statement, encoding='utf-8')
+
+    rows, _ = import_csv(db, str(filename))
+
+    assert rows == 3
+    in_eur = {x.price: x.in_eur for x in db.query(Expense)}
+    assert in_eur == {1250: 1250, 3000: None, 700: 700}
+    pending = db.query(PendingConversion).one()
+    assert pending.expense.price == 3000
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Run from the repository root: python -m pytest"""
+
+from expenses.currencies import statistics
+from expenses.data_connector import db_create, db_connect, drop_engine,\
+    insert_rows
+from expenses.data_model import Expense, Category
+from expenses.reference_data import invalidate_reference_data
+from expenses.reports import statistics_range
+from sqlalchemy import event
+import datetime as dt
+import random
+import pytest
+
+
+def random_rows(rng, rows, category_ids):
+    """Expenses of 2020, many on the first and last days of months."""
+    for _ in range(rows):
+        day = dt.datetime(2020, rng.randrange(1, 13), 1)
+        if rng.random() < 0.4:
+            # first or last day, at midnight or later
+            if rng.random() < 0.5:
+                day = (day + dt.timedelta(days=32)).replace(day=1) - \
+                    dt.timedelta(days=1)
+            minutes = rng.choice([0, rng.randrange(24 * 60)])
+        else:
+            day += dt.timedelta(days=rng.randrange(28))
+            minutes = rng.randrange(24 * 60)
+        issued = day + dt.timedelta(minutes=minutes)
+        end = None
+        repeat_interval = None
+        kind = rng.random()
+        if kind < 0.15:
+            end = issued + dt.timedelta(days=rng.randrange(0, 200))
+        elif kind < 0.3:
+            repeat_interval = rng.randrange(1, 7)
+        yield {'issued': issued,
+               'end': end,
+               'repeat_interval': repeat_interval,
+               'price': 0,
+               'in_eur': rng.randrange(1, 100000),
+               'note': None,
+               'currency_id': 1,
+               'category_id': rng.choice(category_ids)}
+
+
+@pytest.fixture
+def db(tmp_path):
+    name = str(tmp_path / 'expenses.db')
+    db_create(name)
+    db = db_connect(name)
+    db.add_all([Category(name=x) for x in ('Miete', 'Reisen')])
+    db.commit()
+    invalidate_reference_data(db)
+    category_ids = [x.id for x in db.query(Category)]
+    insert_rows(db, Expense,
+                list(random_rows(random.Random(7), 2000, category_ids)))
+    db.commit()
+    yield db
+    db.close()
+    drop_engine(name, None)
+
+
+def test_statistics_range_matches_statistics(db):
+    statements = []
+
+    def count(connection, cursor, statement, *args):
+        if 'FROM expenses' in statement:
+            statements.append(statement)
+
+    event.listen(db.get_bind(), 'before_cursor_execute', count)
+    report = statistics_range(db, dt.datetime(2020, 1, 1),
+                              dt.datetime(2020, 12, 1))
+    event.remove(db.get_bind(), 'before_cursor_execute', count)
+    # simple, long term and repeating expenses, one query each
+    assert len(statements) == 3
+
+    for i, (year, month) in enumerate(report.months):
+        categories, repeaters = statistics(db, year, month)
+        assert dict(zip(report.category_ids,
+                        report.amounts[i].tolist())) == categories
+        assert sorted(x.id for x in report.repeaters[i]) == \
+            sorted(x.id for x in repeaters)
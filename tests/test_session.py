@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Run from the repository root: python -m pytest"""
+
+from command_line import session
+from expenses.data_connector import db_create, db_disconnect, drop_engine
+import pytest
+
+
+@pytest.fixture
+def encrypted(tmp_path):
+    """An encrypted database and its config, cheap to derive keys for."""
+    pytest.importorskip('sqlcipher3')
+    name = str(tmp_path / 'expenses.db')
+    cipher = {'kdf_iter': 1000}
+    db_create(name, 'secret', cipher=cipher)
+    drop_engine(name, 'secret')
+    return {'db': name, 'cipher': cipher}
+
+
+def _open(config, passwords, monkeypatch):
+    passwords = iter(passwords)
+    monkeypatch.setattr(session, 'str_input',
+                        lambda *args, **kwargs: next(passwords))
+    db, name, password = session.open_database(config)
+    db_disconnect(db)
+    drop_engine(name, password)
+    return password
+
+
+def test_open_with_raw_key(encrypted, monkeypatch, capsys):
+    password = _open(encrypted, ['wrong', 'secret'], monkeypatch)
+    assert password.startswith("x'")
+    assert capsys.readouterr().out.count('Wrong password') == 1
+
+
+def test_open_without_header_check(encrypted, monkeypatch, capsys):
+    """Files the header check does not know are opened by sqlcipher."""
+    monkeypatch.setattr(session, 'check_password',
+                        lambda *args, **kwargs: None)
+    password = _open(encrypted, ['wrong', 'secret'], monkeypatch)
+    assert password == 'secret'
+    assert capsys.readouterr().out.count('Wrong password') == 1
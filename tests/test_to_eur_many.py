@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Run from the repository root: python -m pytest"""
+
+from expenses import currencies
+from expenses.currencies import to_eur_many
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+import datetime as dt
+import json
+import pytest
+
+
+rates = {'USD': 1.25, 'CHF': 1.1, 'GBP': 0.8}
+
+
+class RateHandler(BaseHTTPRequestHandler):
+    """Answers like the rate api with the symbols asked for."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    requests = []
+    lock = Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.requests.append(self.path)
+        symbols = self.path.split('symbols=')[1].split(',')
+        body = json.dumps({'base': 'EUR', 'rates': {
+            symbol: rates[symbol] for symbol in symbols}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def rate_server(monkeypatch):
+    """Requests made to a local stub of the rate api."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RateHandler)
+    Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05},
+           daemon=True).start()
+    monkeypatch.setattr(currencies, 'rate_api',
+                        'http://127.0.0.1:{}/{{date}}?symbols={{symb}}'
+                        .format(server.server_port))
+    monkeypatch.setattr(currencies, 'rate_history', None)
+    currencies.clear_rate_cache()
+    RateHandler.requests = []
+    yield RateHandler.requests
+    server.shutdown()
+    server.server_close()
+    currencies.clear_rate_cache()
+
+
+def test_to_eur_many(rate_server):
+    first = dt.datetime(2020, 1, 1, 12, 30)
+    second = dt.date(2020, 1, 2)
+    items = [(1000, 'USD', first),
+             (500, 'EUR', first),
+             (2200, 'CHF', first),
+             (3000, 'USD', dt.datetime(2020, 1, 1, 8, 0)),
+             (800, 'GBP', second),
+             (1250, 'USD', second),
+             (400, 'GBP', second)]
+
+    converted = to_eur_many(items)
+
+    assert converted == [800, 500, 2000, 2400, 1000, 1000, 500]
+    # one request per day with all its currencies, duplicates only once
+    assert sorted(rate_server) == ['/2020-01-01?symbols=CHF,USD',
+                                   '/2020-01-02?symbols=GBP,USD']
+
+
+def test_to_eur_many_cached(rate_server):
+    to_eur_many([(1000, 'USD', dt.date(2020, 1, 1))])
+    converted = to_eur_many([(1000, 'USD', dt.date(2020, 1, 1)),
+                             (700, 'EUR', dt.date(2020, 1, 1))])
+    assert converted == [800, 700]
+    assert rate_server == ['/2020-01-01?symbols=USD']
+
+
+def test_to_eur_many_only_eur(rate_server):
+    assert to_eur_many([(100, 'EUR', dt.date(2020, 1, 1))]) == [100]
+    assert rate_server == []